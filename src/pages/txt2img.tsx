@@ -27,7 +27,14 @@ type ProgressUpdate =
       jobId: string;
       stepDescription: string | null;
     }
-  | { jobId: string; queuePos: number };
+  | QueueStatus;
+
+type QueueStatus = {
+  jobId: string;
+  queuePos: number;
+  startsAt?: number;
+  finishesAt?: number;
+};
 
 function Progress({ status }: { status: ProgressUpdate | null }) {
   if (status == null) return <div>Idle</div>;
@@ -35,6 +42,11 @@ function Progress({ status }: { status: ProgressUpdate | null }) {
     return (
       <div>
         Job {status.jobId} is number {status.queuePos} in line.
+        {status.startsAt != null &&
+          ` Expected to start in about ${Math.max(
+            Math.round(status.startsAt - Date.now() / 1000),
+            0,
+          )} seconds.`}
       </div>
     );
   }
@@ -50,15 +62,24 @@ function Progress({ status }: { status: ProgressUpdate | null }) {
   );
 }
 
+type JobImage = { data: ArrayBuffer; type: string; nsfw: boolean };
+
 type JobRequestResponse =
-  | {
+  | ({
       status: 'enqueued';
+    } & QueueStatus)
+  | {
+      status: 'complete';
       jobId: string;
-      queuePos: number;
+      result: { seed: number; images: JobImage[] };
     }
   | {
       status: 'error';
       error: string;
+    }
+  | {
+      status: 'rejected';
+      reason: string;
     };
 
 type JobRequest = {
@@ -68,7 +89,11 @@ type JobRequest = {
   width?: number;
   height?: number;
   steps?: number;
+  scheduler?: string;
   nsfw?: boolean;
+  count?: number;
+  seed?: number;
+  preview?: number;
 };
 
 const Home: NextPage = () => {
@@ -78,6 +103,8 @@ const Home: NextPage = () => {
     | null
   >(null);
   const [url, setUrl] = useState<string | null>();
+  const [partialUrls, setPartialUrls] = useState<string[]>([]);
+  const [previewUrls, setPreviewUrls] = useState<string[]>([]);
   const [progressStatus, setProgressStatus] = useState<ProgressUpdate | null>(
     null,
   );
@@ -95,27 +122,72 @@ const Home: NextPage = () => {
         setResult({ status: 'error', error: 'Prompt must be a string' });
         return;
       }
+      const count = Number(formData.get('count') ?? 1);
+      const seedField = formData.get('seed');
+      const seed =
+        typeof seedField === 'string' && seedField !== ''
+          ? Number(seedField)
+          : undefined;
+      const preview = formData.get('preview') === 'on' ? 5 : undefined;
+      const schedulerField = formData.get('scheduler');
+      const scheduler =
+        typeof schedulerField === 'string' && schedulerField !== ''
+          ? schedulerField
+          : undefined;
       setResult(null);
+      setPartialUrls([]);
+      setPreviewUrls([]);
       const request: JobRequest = {
         type: 'txt2img',
         prompt,
         width: 128,
         height: 128,
         steps: 25,
+        scheduler,
         nsfw: true,
         model: 'hakurei/waifu-diffusion',
+        count,
+        seed,
+        preview,
       };
       socket.emit('job_request', request, (e: JobRequestResponse) => {
         if (e.status === 'error') {
           setResult({ status: 'error', error: e.error });
           return;
         }
-        setProgressStatus({ jobId: e.jobId, queuePos: e.queuePos });
+        if (e.status === 'rejected') {
+          setResult({ status: 'error', error: e.reason });
+          return;
+        }
+        if (e.status === 'complete') {
+          const [first, ...rest] = e.result.images;
+          setResult({
+            status: 'success',
+            data: new Blob([first.data], { type: first.type }),
+          });
+          setPartialUrls(
+            rest.map((image) =>
+              URL.createObjectURL(new Blob([image.data], { type: image.type })),
+            ),
+          );
+          return;
+        }
+        setProgressStatus({
+          jobId: e.jobId,
+          queuePos: e.queuePos,
+          startsAt: e.startsAt,
+          finishesAt: e.finishesAt,
+        });
       });
     },
     [socket],
   );
 
+  const cancel = useCallback(() => {
+    if (!socket || !progressStatus) return;
+    socket.emit('job_cancel', progressStatus.jobId);
+  }, [socket, progressStatus]);
+
   useEffect(() => {
     if (!socket) return;
     const onJobComplete = (
@@ -133,6 +205,11 @@ const Home: NextPage = () => {
     ) => {
       setProgressStatus((old) => {
         if (old?.jobId !== res.jobId) return old;
+        setPreviewUrls([]);
+        if (res.status === 'success' && data.data == null) {
+          // The images of a multi-image job already arrived as job_partial
+          return null;
+        }
         if (res.status === 'success') {
           setResult({
             status: 'success',
@@ -147,17 +224,81 @@ const Home: NextPage = () => {
         return null;
       });
     };
+    const onJobPartial = (
+      res: { jobId: string; index: number; count: number },
+      data: Record<string, any>,
+    ) => {
+      setProgressStatus((old) => {
+        if (old?.jobId !== res.jobId) return old;
+        const partialUrl = URL.createObjectURL(
+          new Blob([data.data], { type: data.type }),
+        );
+        setPartialUrls((urls) => [...urls, partialUrl]);
+        return old;
+      });
+    };
+    const onJobPreview = (
+      res: { jobId: string; index: number; step: number },
+      data: Record<string, any>,
+    ) => {
+      setProgressStatus((old) => {
+        if (old?.jobId !== res.jobId) return old;
+        const previewUrl = URL.createObjectURL(
+          new Blob([data.data], { type: data.type }),
+        );
+        setPreviewUrls((urls) => {
+          const next = [...urls];
+          next[res.index] = previewUrl;
+          return next;
+        });
+        return old;
+      });
+    };
     const onProgress = (args: ProgressUpdate) => {
       setProgressStatus((old) => {
         if (old?.jobId !== args.jobId) return old;
         return { ...args };
       });
     };
+    const onQueueUpdate = (args: { jobs: QueueStatus[] }) => {
+      setProgressStatus((old) => {
+        const update = args.jobs.find((job) => job.jobId === old?.jobId);
+        if (!update) return old;
+        return { ...update };
+      });
+    };
+    const onJobsRestored = (args: {
+      jobs: (
+        | ({ status: 'enqueued' } & QueueStatus)
+        | { status: 'error'; jobId: string; error: string }
+      )[];
+    }) => {
+      // Jobs of an earlier visit, queued again after a server restart
+      const failed = args.jobs.find((job) => job.status === 'error');
+      if (failed?.status === 'error') {
+        setResult({ status: 'error', error: failed.error });
+      }
+      const restored = args.jobs.find((job) => job.status === 'enqueued');
+      if (restored?.status !== 'enqueued') return;
+      setProgressStatus((old) => {
+        if (old != null) return old;
+        const { status, ...queueStatus } = restored;
+        return queueStatus;
+      });
+    };
     socket.on('job_complete', onJobComplete);
+    socket.on('jobs_restored', onJobsRestored);
+    socket.on('job_partial', onJobPartial);
+    socket.on('job_preview', onJobPreview);
     socket.on('job_progress', onProgress);
+    socket.on('queue_update', onQueueUpdate);
     return () => {
       socket.off('job_complete', onJobComplete);
+      socket.off('jobs_restored', onJobsRestored);
+      socket.off('job_partial', onJobPartial);
+      socket.off('job_preview', onJobPreview);
       socket.off('job_progress', onProgress);
+      socket.off('queue_update', onQueueUpdate);
     };
   }, [socket]);
 
@@ -175,13 +316,53 @@ const Home: NextPage = () => {
           className="text-black"
           autoComplete="off"
         />
+        <input
+          type="number"
+          name="count"
+          className="text-black w-16"
+          min={1}
+          max={8}
+          defaultValue={1}
+        />
+        <input
+          type="number"
+          name="seed"
+          className="text-black w-32"
+          min={0}
+          placeholder="random seed"
+        />
+        <select
+          name="scheduler"
+          className="text-black"
+          defaultValue="dpm_multistep"
+        >
+          <option value="">default</option>
+          <option value="dpm_multistep">DPM-Solver++</option>
+          <option value="unipc">UniPC</option>
+          <option value="euler_a">Euler a</option>
+          <option value="ddim">DDIM</option>
+        </select>
+        <label>
+          <input type="checkbox" name="preview" /> preview
+        </label>
         <input type="submit" value="start" />
+        {progressStatus && (
+          <button type="button" onClick={cancel}>
+            cancel
+          </button>
+        )}
       </form>
       {!url && <Progress status={progressStatus} />}
+      {previewUrls.map((previewUrl) => (
+        <img key={previewUrl} src={previewUrl} className="w-32" />
+      ))}
       {result?.status === 'error' && (
         <div className="bg-red-500 text-white p-4">{result.error}</div>
       )}
       {url && <img src={url} />}
+      {partialUrls.map((partialUrl) => (
+        <img key={partialUrl} src={partialUrl} />
+      ))}
     </div>
   );
 };
@@ -0,0 +1,28 @@
+from typing import Optional, Sequence, Union
+from . import BaseProgressReporter, completeStatus
+
+class BatchProgressReporter(BaseProgressReporter):
+  """Mirrors the progress of one batched run onto the reporters of every job in the batch."""
+
+  def __init__(self, reporters: Sequence[BaseProgressReporter], totalSteps: Optional[int] = None):
+    super().__init__(totalSteps)
+    self.reporters = list(reporters)
+
+  def sendProgress(self, progress: Optional[Union[float, bool]]):
+    for reporter in self.reporters:
+      reporter.step = self.step
+      reporter.totalSteps = self.totalSteps
+      reporter.stepDescription = self.stepDescription
+      reporter.sendProgress(progress)
+
+  def checkCancelled(self):
+    # A batch only stops once every job in it has been cancelled, the
+    # remaining jobs drop their results in ``complete`` instead.
+    for reporter in self.reporters:
+      if reporter.cancellation is None or not reporter.cancellation.cancelled:
+        return
+    self.reporters[0].checkCancelled()
+
+  def complete(self, status: completeStatus, **kwargs):
+    for reporter in self.reporters:
+      reporter.complete(status, **kwargs)
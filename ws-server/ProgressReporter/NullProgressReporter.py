@@ -0,0 +1,11 @@
+from typing import Optional, Union
+from . import BaseProgressReporter, completeStatus
+
+class NullProgressReporter(BaseProgressReporter):
+  """Reporter for work done on behalf of a job that its client shouldn't see, like prefetching."""
+
+  def sendProgress(self, progress: Optional[Union[float, bool]]):
+    pass
+
+  def complete(self, status: completeStatus, **kwargs):
+    pass
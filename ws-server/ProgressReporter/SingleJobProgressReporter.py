@@ -17,6 +17,34 @@ class ProgressReporter(BaseProgressReporter):
       progress = None
     self.socketio.emit('job_progress', {'jobId': self.jobId, 'progress': progress, 'step': self.step, 'totalSteps': self.totalSteps, 'stepDescription': self.stepDescription }, to=self.sid)
 
+  def partial(self, index: int, count: int, **kwargs):
+    self.socketio.emit(
+      'job_partial',
+      (
+        {
+          "jobId": self.jobId,
+          "index": index,
+          "count": count,
+        },
+        kwargs
+      ),
+      to=self.sid
+    )
+
+  def preview(self, index: int, step: int, **kwargs):
+    self.socketio.emit(
+      'job_preview',
+      (
+        {
+          "jobId": self.jobId,
+          "index": index,
+          "step": step,
+        },
+        kwargs
+      ),
+      to=self.sid
+    )
+
   def complete(self, status: completeStatus, **kwargs):
     self.socketio.emit(
       'job_complete',
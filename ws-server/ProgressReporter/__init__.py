@@ -1,9 +1,12 @@
 from abc import ABC, abstractmethod
 import io
-from typing import Any, Literal, Optional, Union
-from diffusers import DiffusionPipeline
+from typing import TYPE_CHECKING, Any, Literal, Optional, Union
+from cancellation import CancellationToken
 
-completeStatus = Literal['success', 'error']
+if TYPE_CHECKING:
+  from diffusers import DiffusionPipeline
+
+completeStatus = Literal['success', 'error', 'cancelled']
 
 class BaseProgressReporter(ABC):
 
@@ -12,6 +15,7 @@ class BaseProgressReporter(ABC):
     self.step = 0
     self.totalSteps = totalSteps
     self.stepDescription = None
+    self.cancellation: Optional[CancellationToken] = None
 
   @abstractmethod
   def sendProgress(self, progress: Optional[Union[float, bool]]):
@@ -21,6 +25,14 @@ class BaseProgressReporter(ABC):
   def complete(self, status: completeStatus, **kwargs):
     pass
 
+  def partial(self, index: int, count: int, **kwargs):
+    """Delivers one of the ``count`` results of a job ahead of its completion."""
+    pass
+
+  def preview(self, index: int, step: int, **kwargs):
+    """Delivers a rough look at result ``index`` as it stands after ``step``."""
+    pass
+
   def setStep(self, step: int, description: Optional[str] = None, progress: Optional[Union[float, bool]] = None):
     if (self.totalSteps is not None and step > self.totalSteps):
       self.totalSteps = None
@@ -28,12 +40,16 @@ class BaseProgressReporter(ABC):
     self.stepDescription = description
     self.sendProgress(progress)
   
+  def checkCancelled(self):
+    if self.cancellation is not None:
+      self.cancellation.check()
+
   def nextStep(self, description: Optional[str] = None, progress: Optional[Union[float, bool]] = None):
     self.setStep(self.step + 1, description, progress)
 
-  def attachToDiffusionPipeline(self, target: DiffusionPipeline):
+  def attachToDiffusionPipeline(self, target: 'DiffusionPipeline'):
     file = DiffusionPipelineFile(self)
-    target.set_progress_bar_config(file=file, bar_format="{percentage}", write_bytes=True, disable=False)
+    target.set_progress_bar_config(file=file, bar_format="{percentage}", write_bytes=True, disable=False, mininterval=0)
 
 
 class DiffusionPipelineFile:
@@ -48,6 +64,9 @@ class DiffusionPipelineFile:
     val = self.buffer.getvalue()
     self.buffer.seek(0)
     self.buffer.truncate(0)
+    # tqdm flushes after every denoising step, which makes this the place to
+    # abort a cancelled run.
+    self.parent.checkCancelled()
     try:
       self.parent.sendProgress(float(val))
     except:
@@ -0,0 +1,50 @@
+from threading import Lock
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+  from job import BaseJob
+
+class AdmissionRejected(Exception):
+  pass
+
+class AdmissionController:
+  """
+  Keeps track of the outstanding cost of queued and running jobs, per owner
+  and in total, and rejects jobs that would exceed the configured limits.
+  Costs are measured in units of one 512x512, 50 step txt2img run.
+  """
+
+  def __init__(self, maxJobCost: float, userBudget: float, queueCeiling: float):
+    self.maxJobCost = maxJobCost
+    self.userBudget = userBudget
+    self.queueCeiling = queueCeiling
+    self.outstanding: 'dict[str, float]' = {}
+    self.total = 0.0
+    self._costs: 'dict[str, float]' = {}
+    self._lock = Lock()
+
+  def admit(self, job: 'BaseJob'):
+    cost = job.cost()
+    with self._lock:
+      if cost > self.maxJobCost:
+        raise AdmissionRejected(f'Job cost {cost:.1f} exceeds the limit of {self.maxJobCost:.1f} per job')
+      used = self.outstanding.get(job.owner, 0.0)
+      if used + cost > self.userBudget:
+        raise AdmissionRejected(f'Your queued jobs already cost {used:.1f} of your budget of {self.userBudget:.1f}')
+      if self.total + cost > self.queueCeiling:
+        raise AdmissionRejected('The queue is full, try again later')
+      self.outstanding[job.owner] = used + cost
+      self.total += cost
+      self._costs[job.id] = cost
+
+  def release(self, job: 'BaseJob'):
+    with self._lock:
+      cost = self._costs.pop(job.id, None)
+      if cost is None:
+        return
+      self.total -= cost
+      remaining = self.outstanding.get(job.owner, 0.0) - cost
+      if remaining <= 0:
+        self.outstanding.pop(job.owner, None)
+      else:
+        self.outstanding[job.owner] = remaining
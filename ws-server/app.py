@@ -1,13 +1,39 @@
+import os
 import traceback
-from flask import Flask, request
+from flask import Flask, jsonify, request
 from flask_socketio import SocketIO, ConnectionRefusedError
 from socketio import Server
 from tokenProcessor import verify
 from worker import Worker
+from admission import AdmissionRejected
 
 app=Flask(__name__, static_url_path='')
 app.config['SECRET_KEY'] = 'secret!'
 app.config['HOST_UPDATE_INTERVAL'] = 5
+# Comma separated lanes, e.g. "cuda:0,cuda:1" or "cpu:4,cpu:4". Autodetected when unset.
+# Cpu lanes with different thread counts always run in processes.
+app.config['WORKER_LANES'] = os.environ.get('WORKER_LANES')
+# Run jobs in spawned processes instead of threads of the socket server
+app.config['WORKER_PROCESSES'] = os.environ.get('WORKER_PROCESSES', '0') == '1'
+# Path of the SQLite journal that lets queued jobs survive a restart, disabled when unset
+app.config['JOB_JOURNAL'] = os.environ.get('JOB_JOURNAL')
+# Journaled jobs older than this many seconds are dropped instead of replayed
+app.config['JOB_JOURNAL_MAX_AGE'] = float(os.environ.get('JOB_JOURNAL_MAX_AGE', 24 * 60 * 60))
+# Admission limits, in units of one 512x512, 50 step txt2img run
+app.config['MAX_JOB_COST'] = float(os.environ.get('MAX_JOB_COST', 8))
+app.config['USER_COST_BUDGET'] = float(os.environ.get('USER_COST_BUDGET', 16))
+app.config['QUEUE_COST_CEILING'] = float(os.environ.get('QUEUE_COST_CEILING', 200))
+# Runtime guess for job buckets the estimator has no samples for yet
+app.config['DEFAULT_SECONDS_PER_COST'] = float(os.environ.get('DEFAULT_SECONDS_PER_COST', 10))
+# How many upcoming jobs get their models loaded ahead of time, defaults to one per lane
+if os.environ.get('PREFETCH_DEPTH') is not None:
+  app.config['PREFETCH_DEPTH'] = int(os.environ['PREFETCH_DEPTH'])
+# How often a queued job may be overtaken by jobs reusing the model a lane already has loaded
+app.config['AFFINITY_MAX_OVERTAKES'] = int(os.environ.get('AFFINITY_MAX_OVERTAKES', 4))
+# Compatible txt2img jobs are coalesced into one pipeline call of up to this
+# many images, waiting at most BATCH_WINDOW seconds for the batch to fill up.
+app.config['BATCH_MAX_SIZE'] = int(os.environ.get('BATCH_MAX_SIZE', 4))
+app.config['BATCH_WINDOW'] = float(os.environ.get('BATCH_WINDOW', 0))
 socketio=SocketIO(app, cors_allowed_origins="*", logger=True, engineio_logger=True)
 backgroundWorker=Worker(app, socketio)
 
@@ -20,10 +46,10 @@ def handle_connect(auth):
   if (jwtToken is None):
     raise ConnectionRefusedError('No jwtToken in auth')
   try:
-    verify(jwtToken)
+    claims = verify(jwtToken)
   except Exception as e:
     raise ConnectionRefusedError('Invalid token: ' + str(e))
-  backgroundWorker.registerSid(request.sid)
+  backgroundWorker.registerSid(request.sid, claims.get('sub'))
   print("socket connected")
 
 @socketio.on('disconnect')
@@ -46,9 +72,25 @@ def send_packet(server: Server, eio_sid, pkt):
 def handler(jobDef):
   sid = request.sid
   try:
-    (jobId, qpos) = backgroundWorker.enqueueJob(sid, jobDef)
-    return {'status': 'enqueued', 'jobId': jobId, 'queuePos': qpos}
+    status = backgroundWorker.enqueueJob(sid, jobDef)
+    if 'result' in status:
+      # Served from the result cache
+      return {'status': 'complete', **status}
+    return {'status': 'enqueued', **status}
+  except AdmissionRejected as e:
+    return {'status': 'rejected', 'reason': str(e)}
   except Exception as e:
     traceback.print_exc()
     return {'status': 'error', 'error': str(e)}
 
+
+@app.route('/stats')
+def stats():
+  return jsonify(backgroundWorker.stats())
+
+
+@socketio.on('job_cancel')
+def cancel_handler(jobId):
+  if backgroundWorker.cancelJob(request.sid, jobId):
+    return {'status': 'cancelled', 'jobId': jobId}
+  return {'status': 'error', 'error': 'Unknown job'}
@@ -0,0 +1,58 @@
+"""
+Measures the time from starting the server until it answers its first
+Socket.IO handshake, with the model zoo and the diffusion stack imported
+lazily, and with them imported up front the way the server used to.
+
+Run from the ws-server directory: ``python benchmarks/cold_start.py``
+"""
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HANDSHAKE_URL = 'http://127.0.0.1:5000/socket.io/?EIO=4&transport=polling'
+REPEATS = 3
+
+# What importing app.py used to pull in before any job needed it
+EAGER_IMPORTS = (
+  'import diffusers, transformers, cv2, h5py, torchvision\n'
+  'import super_image.models as models\n'
+  'for name in models.__all__: getattr(models, name)\n'
+)
+START_SERVER = 'import runpy; runpy.run_path("main.py", run_name="__main__")\n'
+
+def firstConnect(eager: bool) -> float:
+  env = dict(os.environ, WORKER_LANES='cpu', WORKER_PROCESSES='0', PREFETCH_DEPTH='0')
+  code = (EAGER_IMPORTS if eager else '') + START_SERVER
+  start = time.perf_counter()
+  server = subprocess.Popen(
+    [sys.executable, '-c', code],
+    cwd=SERVER_DIR,
+    env=env,
+    stdout=subprocess.DEVNULL,
+    stderr=subprocess.DEVNULL,
+  )
+  try:
+    while True:
+      if server.poll() is not None:
+        raise RuntimeError('The server exited before accepting a connection')
+      try:
+        urllib.request.urlopen(HANDSHAKE_URL, timeout=1).read()
+        return time.perf_counter() - start
+      except urllib.error.HTTPError:
+        # Any answer means the server is up
+        return time.perf_counter() - start
+      except OSError:
+        time.sleep(0.01)
+  finally:
+    server.kill()
+    server.wait()
+
+if __name__ == '__main__':
+  print(f"{'imports':<8} {'first connect s':>16}")
+  for eager in (True, False):
+    seconds = min(firstConnect(eager) for _ in range(REPEATS))
+    print(f"{'eager' if eager else 'lazy':<8} {seconds:>16.2f}")
@@ -0,0 +1,71 @@
+"""
+Compares the per-job queue position broadcast that ``Worker.updateQueue`` used
+to do with the coalesced, change-only ``FairShareQueue.changedPositions``.
+
+Run from the ws-server directory: ``python benchmarks/queue_updates.py``
+"""
+import json
+import os
+import sys
+import time
+from uuid import uuid4
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheduler import FairShareQueue
+
+class FakeJob:
+  def __init__(self, sid: str):
+    self.id = str(uuid4())
+    self.sid = sid
+    self.owner = sid
+    self.overtaken = 0
+    self.queuePos = None
+    self.eta = None
+    self.estimate = 10.0
+
+  def modelKey(self):
+    return None
+
+def fill(length: int) -> FairShareQueue:
+  # One client floods the queue, the rest submit a couple of jobs each.
+  queue = FairShareQueue()
+  light = max(length // 10, 1)
+  for i in range(length):
+    sid = 'heavy' if i % 2 == 0 else f'light-{i % light}'
+    queue.put(FakeJob(sid))
+  return queue
+
+def emit(payload) -> int:
+  # Stands in for socketio.emit, which at least has to serialize the packet.
+  json.dumps(payload)
+  return 1
+
+def perJob(queue: FairShareQueue) -> int:
+  emits = 0
+  while queue.qsize() > 0:
+    queue.get()
+    for (i, job) in enumerate(list(queue.snapshot())):
+      emits += emit({ 'jobId': job.id, 'queuePos': i + 1 })
+  return emits
+
+def coalesced(queue: FairShareQueue) -> int:
+  emits = 0
+  while queue.qsize() > 0:
+    queue.get()
+    for jobs in queue.changedPositions().values():
+      emits += emit({ 'jobs': [{ 'jobId': job.id, 'queuePos': job.queuePos } for job in jobs] })
+  return emits
+
+def measure(strategy, length: int):
+  queue = fill(length)
+  start = time.process_time()
+  emits = strategy(queue)
+  return (emits, time.process_time() - start)
+
+if __name__ == '__main__':
+  print(f"{'queue':>6} {'per-job emits':>14} {'cpu s':>8} {'coalesced emits':>16} {'cpu s':>8}")
+  for length in (10, 50, 100, 500, 1000):
+    (oldEmits, oldTime) = measure(perJob, length)
+    (newEmits, newTime) = measure(coalesced, length)
+    print(f"{length:>6} {oldEmits:>14} {oldTime:>8.4f} {newEmits:>16} {newTime:>8.4f}")
@@ -0,0 +1,55 @@
+"""
+Measures the cold construction of upscale models from a checkpoint: building
+the model with its random initialization and copying every tensor over, as
+``from_pretrained`` used to, against ``PreTrainedModel._construct`` which skips
+the initializers and takes the checkpoint tensors over in one pass.
+
+Checkpoints are taken from a freshly built model, so no download is needed.
+
+Run from the ws-server directory: ``python benchmarks/super_image_construct.py``
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MODELS = (
+  ('EdsrModel', 'EdsrConfig'),
+  ('MsrnModel', 'MsrnConfig'),
+  ('DrlnModel', 'DrlnConfig'),
+  ('HanModel', 'HanConfig'),
+  ('RcanModel', 'RcanConfig'),
+)
+REPEATS = 3
+
+def initialized(modelClass, config, stateDict):
+  import torch
+  model = modelClass(config)
+  ownState = model.state_dict()
+  with torch.no_grad():
+    for (name, tensor) in stateDict.items():
+      ownState[name].copy_(tensor)
+  return model
+
+def skipped(modelClass, config, stateDict):
+  return modelClass._construct(config, stateDict)
+
+def measure(construct, modelClass, config, stateDict) -> float:
+  best = float('inf')
+  for _ in range(REPEATS):
+    start = time.perf_counter()
+    construct(modelClass, config, stateDict)
+    best = min(best, time.perf_counter() - start)
+  return best
+
+if __name__ == '__main__':
+  import super_image.models as models
+  print(f"{'model':<10} {'init + copy s':>14} {'skip init s':>12} {'speedup':>8}")
+  for (className, configName) in MODELS:
+    modelClass = getattr(models, className)
+    config = getattr(models, configName)(scale=4)
+    stateDict = {name: tensor.clone() for (name, tensor) in modelClass(config).state_dict().items()}
+    before = measure(initialized, modelClass, config, stateDict)
+    after = measure(skipped, modelClass, config, stateDict)
+    print(f"{className:<10} {before:>14.3f} {after:>12.3f} {before / after:>7.1f}x")
@@ -0,0 +1,47 @@
+"""
+Measures load time and peak RSS of ``from_pretrained`` for DRLN and HAN, from
+the pickled checkpoint and from the converted, memory-mapped one. Every load
+runs in a fresh process so peak RSS isn't shared between measurements.
+
+Run from the ws-server directory: ``python benchmarks/super_image_load.py``
+"""
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MODELS = (
+  ('eugenesiow/drln', 'DrlnModel', 4),
+  ('eugenesiow/han', 'HanModel', 4),
+)
+
+def load(repo: str, className: str, scale: int, safetensors: bool, results):
+  import super_image.models as models
+  from super_image import modeling_utils
+  if not safetensors:
+    # Pretend no converted checkpoint exists
+    modeling_utils.SAFE_WEIGHTS_NAME_SCALE = 'missing_{scale}x.safetensors'
+  start = time.perf_counter()
+  getattr(models, className).from_pretrained(repo, scale=scale)
+  seconds = time.perf_counter() - start
+  results.put((seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+def measure(*args):
+  context = multiprocessing.get_context('spawn')
+  results = context.Queue()
+  process = context.Process(target=load, args=(*args, results))
+  process.start()
+  process.join()
+  return results.get()
+
+if __name__ == '__main__':
+  from super_image.convert import convert_pretrained
+  print(f"{'model':<18} {'format':<12} {'load s':>8} {'peak RSS MiB':>13}")
+  for (repo, className, scale) in MODELS:
+    convert_pretrained(repo, scale)
+    for safetensors in (False, True):
+      (seconds, rss) = measure(repo, className, scale, safetensors)
+      print(f"{repo:<18} {'safetensors' if safetensors else 'pickle':<12} {seconds:>8.2f} {rss:>13.0f}")
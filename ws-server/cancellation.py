@@ -0,0 +1,20 @@
+from threading import Event
+
+class JobCancelled(Exception):
+  pass
+
+class CancellationToken:
+  def __init__(self):
+    self._event = Event()
+
+  @property
+  def cancelled(self) -> bool:
+    return self._event.is_set()
+
+  def cancel(self):
+    self._event.set()
+
+  def check(self):
+    """Raises :class:`JobCancelled` once the token has been cancelled."""
+    if self._event.is_set():
+      raise JobCancelled()
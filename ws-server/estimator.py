@@ -0,0 +1,79 @@
+from threading import Lock
+from typing import TYPE_CHECKING, Hashable
+
+if TYPE_CHECKING:
+  from job import BaseJob
+
+class _Bucket:
+  __slots__ = ('seconds', 'samples')
+
+  def __init__(self, seconds: float):
+    self.seconds = seconds
+    self.samples = 1
+
+class _Regression:
+  """Ordinary least squares of wall time over job cost, updated one sample at a time."""
+  __slots__ = ('n', 'sx', 'sy', 'sxx', 'sxy')
+
+  def __init__(self):
+    (self.n, self.sx, self.sy, self.sxx, self.sxy) = (0, 0.0, 0.0, 0.0, 0.0)
+
+  def add(self, x: float, y: float):
+    self.n += 1
+    self.sx += x
+    self.sy += y
+    self.sxx += x * x
+    self.sxy += x * y
+
+  def predict(self, x: float):
+    if self.n == 0:
+      return None
+    denominator = self.n * self.sxx - self.sx * self.sx
+    if self.n < 2 or abs(denominator) < 1e-9:
+      # Not enough spread in the samples yet, assume time is proportional to cost
+      return self.sy / self.sx * x if self.sx > 0 else self.sy / self.n
+    slope = (self.n * self.sxy - self.sx * self.sy) / denominator
+    intercept = (self.sy - slope * self.sx) / self.n
+    return max(intercept + slope * x, 0.0)
+
+class RuntimeEstimator:
+  """
+  Learns how long jobs take. Every ``estimateKey`` bucket (job type, model,
+  resolution, steps) keeps an exponentially weighted mean of its wall times,
+  and every (job type, model) pair an online regression over job cost that
+  covers buckets that haven't been seen yet. Recording and estimating are
+  both O(1).
+  """
+
+  def __init__(self, defaultSecondsPerCost: float = 10.0, smoothing: float = 0.3):
+    self.defaultSecondsPerCost = defaultSecondsPerCost
+    self.smoothing = smoothing
+    self._buckets: 'dict[Hashable, _Bucket]' = {}
+    self._regressions: 'dict[Hashable, _Regression]' = {}
+    self._lock = Lock()
+
+  def estimate(self, job: 'BaseJob') -> float:
+    key = job.estimateKey()
+    with self._lock:
+      bucket = self._buckets.get(key)
+      if bucket is not None:
+        return bucket.seconds
+      regression = self._regressions.get(key[:2])
+      predicted = regression.predict(job.cost()) if regression is not None else None
+    if predicted is not None:
+      return predicted
+    return job.cost() * self.defaultSecondsPerCost
+
+  def record(self, job: 'BaseJob', seconds: float):
+    key = job.estimateKey()
+    with self._lock:
+      bucket = self._buckets.get(key)
+      if bucket is None:
+        self._buckets[key] = _Bucket(seconds)
+      else:
+        bucket.seconds += self.smoothing * (seconds - bucket.seconds)
+        bucket.samples += 1
+      regression = self._regressions.get(key[:2])
+      if regression is None:
+        regression = self._regressions[key[:2]] = _Regression()
+      regression.add(job.cost(), seconds)
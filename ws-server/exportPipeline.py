@@ -0,0 +1,21 @@
+"""
+Exports txt2img pipelines cast to half precision, so lanes load them without
+converting the weights. Exported pipelines are written to PIPELINE_EXPORT_DIR
+and are about half the size of the full precision originals.
+
+Usage: ``python exportPipeline.py CompVis/stable-diffusion-v1-4 --dtype float16``
+"""
+import argparse
+
+import torch
+
+from job.Txt2ImgJob import ACCEPTED_MODELS, pipelineClass
+from job.utils import exportPipeline
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Export txt2img pipelines in a lower precision.')
+  parser.add_argument('models', nargs='*', help='models to export, every accepted model when omitted')
+  parser.add_argument('--dtype', choices=['float16', 'bfloat16'], default='float16')
+  args = parser.parse_args()
+  for model in args.models or list(ACCEPTED_MODELS):
+    print(exportPipeline(pipelineClass(), model, getattr(torch, args.dtype), use_auth_token=True))
@@ -1,15 +1,91 @@
 from abc import ABC, abstractmethod
+from typing import Callable, Hashable, Optional, Tuple
 from ProgressReporter import BaseProgressReporter, completeStatus
+from cancellation import CancellationToken
 
 class BaseJob(ABC):
   def __init__(self, sid: str, id: str, progressReporter: BaseProgressReporter):
     self.id = id
     self.progressReporter = progressReporter
+    self.cancellation = CancellationToken()
+    progressReporter.cancellation = self.cancellation
     self.sid = sid
+    # Scheduling identity, the JWT uid of the session when known
+    self.owner = sid
+    # Assigned by the lane that picks the job up
+    self.device = 'cpu'
+    # Number of times a job with a warmer model was scheduled ahead of this one
+    self.overtaken = 0
+    # Last queue position reported to the client
+    self.queuePos: Optional[int] = None
+    # Expected wall time in seconds and the last reported (startsAt, finishesAt)
+    self.estimate = 0.0
+    self.eta: Optional[Tuple[float, float]] = None
+    # How the job ended, None until it is completed
+    self.status: Optional[completeStatus] = None
+
+  def modelKey(self) -> Optional[Hashable]:
+    """Jobs with equal model keys can run back to back without swapping weights."""
+    return None
+
+  def cost(self) -> float:
+    """Estimated cost, in units of one 512x512, 50 step txt2img run."""
+    return 1.0
+
+  def estimateKey(self) -> Tuple[Hashable, ...]:
+    """Runtime bucket of the job, starting with its job type and model."""
+    return (type(self).__name__, None)
+
+  def batchKey(self) -> Optional[Hashable]:
+    """Jobs with equal batch keys can be run together by ``runBatch``."""
+    return None
+
+  def batchSize(self) -> int:
+    """Share of a batch the job takes up, batches are capped at BATCH_MAX_SIZE of these."""
+    return 1
+
+  def cachedResult(self, devices: 'list[str]') -> Optional[dict]:
+    """
+    Returns the result of an identical earlier job if it is still cached,
+    sparing this one the queue. ``devices`` are those the job could run on.
+    """
+    return None
+
+  def prefetch(self, device: str) -> Optional[Tuple[Hashable, Callable[[], object], Optional[int]]]:
+    """
+    Returns the staging area key of the model this job will need on ``device``,
+    a function that loads it into cpu memory and an estimate of its size in
+    bytes if known, or None if there is nothing worth prefetching.
+    """
+    return None
+
+  @classmethod
+  def runBatch(cls, jobs: 'list[BaseJob]'):
+    for job in jobs:
+      job.run()
 
   @abstractmethod
   def run(self):
     self.complete({ 'status': 'error', 'error': 'Run method meant to be implemented by subclass' })
 
+  def cancel(self):
+    self.cancellation.cancel()
+
+  @property
+  def cancelled(self) -> bool:
+    return self.cancellation.cancelled
+
+  def partial(self, index: int, count: int, **kwargs):
+    if not self.cancelled:
+      self.progressReporter.partial(index, count, **kwargs)
+
+  def preview(self, index: int, step: int, **kwargs):
+    if not self.cancelled:
+      self.progressReporter.preview(index, step, **kwargs)
+
   def complete(self, status: completeStatus = 'success', **kwargs):
+    if self.cancelled:
+      status = 'cancelled'
+      kwargs = {}
+    self.status = status
     self.progressReporter.complete(status, **kwargs)
@@ -1,14 +1,23 @@
+import copy
 import io
+import random
 import traceback
-from torch import autocast, float32, float16, cuda
-from diffusers import StableDiffusionPipeline, DiffusionPipeline
-from PIL.Image import Image
-from CustomModels.DummySafety import DummySafetyChecker, DummyFeatureExtractor
+from typing import TYPE_CHECKING, Optional
+from PIL import Image
+from torch import Generator, autocast, cuda, einsum, finfo, float32, float16, randn, stack, tensor, device as torchDevice
 
 from .jobParams import Txt2ImgDefinition
-from .utils import loadModel
+from .utils import checkoutCachedModel, loadModel, pipelineKeys
+from .pipelineCache import pipelineCache
+from .resultCache import resultCache
 from .BaseJob import BaseJob
 from ProgressReporter import BaseProgressReporter
+from ProgressReporter.BatchProgressReporter import BatchProgressReporter
+from ProgressReporter.NullProgressReporter import NullProgressReporter
+from cancellation import JobCancelled
+
+if TYPE_CHECKING:
+  from diffusers import DiffusionPipeline
 
 
 ACCEPTED_MODELS = {
@@ -18,13 +27,165 @@ ACCEPTED_MODELS = {
   "CompVis/stable-diffusion-v1-4": 'Stable Diffusion v1.4',
   "hakurei/waifu-diffusion": 'Waifu Diffusion',
 }
+# Parameters of an SD v1 pipeline, UNet, VAE, text encoder and safety checker
+PIPELINE_PARAMETERS = 1_370_000_000
+# Most images a single job may ask for
+MAX_COUNT = 8
+# Largest width or height, the latents are an eighth of the image size
+MAX_DIMENSION = 2048
+MAX_SEED = 2 ** 63 - MAX_COUNT
+# Approximates the VAE decode of Stable Diffusion v1 latents with one linear map
+LATENT_RGB_FACTORS = [
+  [0.298, 0.207, 0.208],
+  [0.187, 0.286, 0.173],
+  [-0.158, 0.189, 0.264],
+  [-0.184, -0.271, -0.473],
+]
+PREVIEW_QUALITY = 60
+# Scheduler name -> (diffusers class, default steps). The multistep solvers
+# reach the quality of 50 PNDM steps in 20 to 25.
+SCHEDULERS = {
+  "pndm": ('PNDMScheduler', 50),
+  "ddim": ('DDIMScheduler', 50),
+  "lms": ('LMSDiscreteScheduler', 50),
+  "euler": ('EulerDiscreteScheduler', 30),
+  "euler_a": ('EulerAncestralDiscreteScheduler', 30),
+  "dpm_multistep": ('DPMSolverMultistepScheduler', 20),
+  "unipc": ('UniPCMultistepScheduler', 20),
+}
+MAX_STEPS = 150
+
+# Share of the free device memory the largest intermediate of the fast path
+# may take, the rest is headroom for the activations around it
+FAST_PATH_MEMORY_FRACTION = 0.5
+# Heads of the self-attention at the highest resolution of the SD v1 UNet
+UNET_ATTENTION_HEADS = 8
+# Channels of the last up block of the VAE decoder, at full resolution
+VAE_DECODER_CHANNELS = 128
+
+def pipelineClass():
+  # diffusers pulls in transformers, only import it once a job needs it
+  from diffusers import StableDiffusionPipeline
+  return StableDiffusionPipeline
+
+def withoutSafetyChecker(pipe: 'DiffusionPipeline') -> 'DiffusionPipeline':
+  """
+  Returns a shallow copy of a cached pipeline with its safety checker swapped
+  for a dummy. The copy shares the UNet, VAE and text encoder of the cached
+  pipeline, so safe and nsfw jobs of a model only keep one set of weights.
+  """
+  from CustomModels.DummySafety import DummySafetyChecker, DummyFeatureExtractor
+  unsafe = copy.copy(pipe)
+  unsafe.safety_checker = DummySafetyChecker
+  unsafe.feature_extractor = DummyFeatureExtractor()
+  return unsafe
+
+def withScheduler(pipe: 'DiffusionPipeline', name: str) -> 'DiffusionPipeline':
+  """
+  Returns a shallow copy of a cached pipeline that denoises with the named
+  scheduler. Schedulers keep state while denoising, so every run builds its
+  own from the model's scheduler config, which only computes the noise
+  schedule.
+  """
+  import diffusers
+  schedulerClass = getattr(diffusers, SCHEDULERS[name][0])
+  scheduled = copy.copy(pipe)
+  scheduled.scheduler = schedulerClass.from_config(pipe.scheduler.config)
+  return scheduled
+
+def freeDeviceMemory(device: str) -> int:
+  """Bytes that can still be allocated on a cuda device, including those the allocator already holds."""
+  (free, _) = cuda.mem_get_info(device)
+  return free + cuda.memory_reserved(device) - cuda.memory_allocated(device)
+
+def peakAttentionBytes(images: int, width: int, height: int, elementSize: int) -> int:
+  """Size of the attention scores of the first UNet block, which grow with the square of the pixel count."""
+  tokens = (width // 8) * (height // 8)
+  # Classifier-free guidance runs every image twice
+  return 2 * images * UNET_ATTENTION_HEADS * tokens ** 2 * elementSize
+
+def peakDecodeBytes(images: int, width: int, height: int, elementSize: int) -> int:
+  """Size of the largest intermediates of a full frame VAE decode of all images at once."""
+  tokens = (width // 8) * (height // 8)
+  # The mid block attends over every latent pixel with one head
+  return images * (tokens ** 2 + 2 * VAE_DECODER_CHANNELS * width * height) * elementSize
+
+def configureMemory(pipe: 'DiffusionPipeline', device: str, images: int, width: int, height: int):
+  """
+  Turns on attention slicing and a tiled VAE decode when the fast path would
+  not fit in the free memory of the device. The UNet and VAE are shared by
+  every copy of the cached pipeline, so both are set on every run, while the
+  run has the pipeline checked out and no other run can change them.
+  """
+  sliceAttention = False
+  tileDecode = False
+  if torchDevice(device).type == 'cuda':
+    budget = freeDeviceMemory(device) * FAST_PATH_MEMORY_FRACTION
+    # Autocast runs the UNet and VAE in half precision
+    sliceAttention = peakAttentionBytes(images, width, height, 2) > budget
+    tileDecode = peakDecodeBytes(images, width, height, 2) > budget
+  if sliceAttention:
+    pipe.enable_attention_slicing()
+  else:
+    pipe.disable_attention_slicing()
+  if tileDecode:
+    # Decodes one image at a time, in overlapping tiles
+    pipe.enable_vae_slicing()
+    pipe.enable_vae_tiling()
+  else:
+    pipe.disable_vae_slicing()
+    pipe.disable_vae_tiling()
+
+def initialLatents(pipe: 'DiffusionPipeline', jobs: 'list[Txt2ImgJob]', device: str):
+  """
+  Draws the starting noise of every image from its own seed, on the cpu so the
+  same seed gives the same image on every device and in every batch.
+  """
+  first = jobs[0]
+  shape = (pipe.unet.in_channels, first.height // 8, first.width // 8)
+  latents = [
+    randn(shape, generator=Generator().manual_seed(job.seed + index))
+    for job in jobs
+    for index in range(job.count)
+  ]
+  return stack(latents).to(device, dtype=next(pipe.unet.parameters()).dtype)
 
-device = 'cuda' if cuda.is_available() and cuda.current_device() else 'cpu'
+def previewImages(latents) -> 'list[bytes]':
+  """
+  Projects latents to RGB at latent resolution and encodes them as JPEG, which
+  costs a tiny fraction of a denoising step, unlike a VAE decode.
+  """
+  factors = tensor(LATENT_RGB_FACTORS, dtype=latents.dtype, device=latents.device)
+  rgb = einsum('nchw,cr->nhwr', latents, factors)
+  arrays = ((rgb + 1) / 2).clamp(0, 1).mul(255).byte().cpu().numpy()
+  previews = []
+  for arr in arrays:
+    data = io.BytesIO()
+    Image.fromarray(arr).save(data, 'JPEG', quality=PREVIEW_QUALITY)
+    previews.append(data.getvalue())
+  return previews
 
-def runModel(pipe: DiffusionPipeline, *args, **kwargs):
+def previewCallback(jobs: 'list[Txt2ImgJob]', progressReporter: BaseProgressReporter):
+  """Returns a pipeline step callback that sends previews to the jobs that asked for them."""
+  offsets = []
+  offset = 0
+  for job in jobs:
+    offsets.append(offset)
+    offset += job.count
+
+  def callback(step: int, timestep, latents):
+    progressReporter.checkCancelled()
+    for (job, offset) in zip(jobs, offsets):
+      if job.previewSteps and (step + 1) % job.previewSteps == 0 and not job.cancelled:
+        for (index, data) in enumerate(previewImages(latents[offset:offset + job.count])):
+          job.preview(index, step + 1, data = data, type = 'image/jpeg')
+  return callback
+
+def runModel(pipe: 'DiffusionPipeline', device: str, *args, **kwargs):
   pipe = pipe.to(device)
-  if (device == 'cuda'):
-    with autocast(device):
+  deviceType = torchDevice(device).type
+  if (deviceType == 'cuda'):
+    with autocast(deviceType):
       return pipe(*args, **kwargs)
   else:
     return pipe(*args, **kwargs)
@@ -37,36 +198,169 @@ class Txt2ImgJob(BaseJob):
       raise Exception('Invalid model')
     self.prompt = job['prompt']
     self.model = model
-    self.steps = job.get('steps') or 50
+    self.scheduler = job.get('scheduler')
+    if (self.scheduler is not None and self.scheduler not in SCHEDULERS):
+      raise Exception('Invalid scheduler')
+    self.steps = job.get('steps') or (SCHEDULERS[self.scheduler][1] if self.scheduler else 50)
+    if (not isinstance(self.steps, int) or not 1 <= self.steps <= MAX_STEPS):
+      raise Exception('Invalid steps')
     self.width = job.get('width') or 512
     self.height = job.get('height') or 512
+    for dimension in (self.width, self.height):
+      if (not isinstance(dimension, int) or not 8 <= dimension <= MAX_DIMENSION or dimension % 8 != 0):
+        raise Exception('Invalid image size')
     self.nsfw = job.get('nsfw') or False
+    self.count = job.get('count') or 1
+    if (not isinstance(self.count, int) or not 1 <= self.count <= MAX_COUNT):
+      raise Exception('Invalid count')
+    seed = job.get('seed')
+    if (seed is not None and (not isinstance(seed, int) or not 0 <= seed <= MAX_SEED)):
+      raise Exception('Invalid seed')
+    # Image i of the job is generated from seed + i
+    self.seeded = seed is not None
+    self.seed = seed if seed is not None else random.randrange(2 ** 32)
+    self.previewSteps = job.get('preview') or 0
+    if (not isinstance(self.previewSteps, int) or self.previewSteps < 0):
+      raise Exception('Invalid preview interval')
+    if (self.previewSteps and not self.nsfw):
+      # Previews are made before the safety checker gets to see the images
+      raise Exception('Previews are only available for nsfw jobs')
+
+  def modelKey(self):
+    return ('txt2img', self.model)
+
+  def cost(self):
+    return self.count * (self.width * self.height * self.steps) / (512 * 512 * 50)
+
+  def estimateKey(self):
+    return ('txt2img', self.model, self.scheduler, self.width, self.height, self.steps, self.count)
+
+  def batchKey(self):
+    return (self.model, self.scheduler, self.width, self.height, self.steps, self.nsfw)
+
+  def batchSize(self):
+    # Every image is a sample of the UNet batch
+    return self.count
+
+  def resultKey(self, index: int, torch_dtype):
+    # Half and full precision runs of the same seed give different images
+    return (self.model, self.prompt, self.seed + index, self.scheduler, self.steps, self.width, self.height, self.nsfw, str(torch_dtype))
+
+  def cachedImages(self, torch_dtype) -> Optional['list[dict]']:
+    images = []
+    for index in range(self.count):
+      cached = resultCache.get(self.resultKey(index, torch_dtype))
+      if cached is None:
+        return None
+      (data, nsfw) = cached
+      images.append({ 'data': data, 'type': 'image/png', 'nsfw': nsfw })
+    return images
+
+  def cachedResult(self, devices: 'list[str]') -> Optional[dict]:
+    if resultCache is None or not self.seeded:
+      return None
+    dtypes = {self.loadArgs(device)['torch_dtype'] for device in devices}
+    for dtype in sorted(dtypes, key=str):
+      images = self.cachedImages(dtype)
+      if images is not None:
+        return { 'seed': self.seed, 'images': images }
+    return None
+
+  def loadArgs(self, device: str):
+    # nsfw jobs share the pipeline of safe ones, see withoutSafetyChecker
+    return dict(
+      use_auth_token=True,
+      torch_dtype=float16 if torchDevice(device).type == 'cuda' else float32,
+    )
+
+  def prefetch(self, device: str):
+    args = self.loadArgs(device)
+    (key, stageKey) = pipelineKeys(self.model, args['torch_dtype'], device)
+    if key in pipelineCache:
+      return None
+    estimate = PIPELINE_PARAMETERS * (finfo(args['torch_dtype']).bits // 8)
+    return (stageKey, lambda: loadModel(pipelineClass(), self.model, NullProgressReporter(), **args), estimate)
 
   def run(self):
-    extraArgs = {}
-    if self.nsfw:
-      extraArgs['safety_checker']=DummySafetyChecker
-      extraArgs['feature_extractor']=DummyFeatureExtractor()
+    self.runBatch([self])
+
+  @classmethod
+  def runBatch(cls, jobs: 'list[Txt2ImgJob]'):
+    first = jobs[0]
+    if len(jobs) == 1:
+      progressReporter = first.progressReporter
+    else:
+      progressReporter = BatchProgressReporter([job.progressReporter for job in jobs])
     try:
-      pipe = loadModel(
-        StableDiffusionPipeline,
-        self.model,
-        self.progressReporter,
-        use_auth_token=True,
-        torch_dtype=float16 if device == 'cuda' else float32,
-        **extraArgs,
-      )
-      self.progressReporter.nextStep('Generating Image', True)
-      result = runModel(pipe, self.prompt, width = self.width, height = self.height, num_inference_steps = self.steps)
-      image: Image = result.images[0]
-      nsfw: bool = result.nsfw_content_detected[0]
-      img_data = io.BytesIO()
-      image.save(img_data, "PNG")
-      self.complete('success',
-        data = img_data.getvalue(),
-        type = 'image/png',
-        nsfw = nsfw,
-      )
+      # Checked out for the whole run, concurrent runs of the same model get
+      # instances of their own, so configureMemory can't be undone mid-run
+      with checkoutCachedModel(
+        pipelineClass(),
+        first.model,
+        progressReporter,
+        device=first.device,
+        **first.loadArgs(first.device),
+      ) as pipe:
+        if first.nsfw:
+          pipe = withoutSafetyChecker(pipe)
+        if first.scheduler is not None:
+          pipe = withScheduler(pipe, first.scheduler)
+        progressReporter.checkCancelled()
+        images = sum(job.count for job in jobs)
+        progressReporter.nextStep('Generating Image' if images == 1 else f'Generating {images} Images', True)
+        configureMemory(pipe, first.device, images, first.width, first.height)
+        extraArgs = {}
+        if any(job.previewSteps for job in jobs):
+          extraArgs['callback'] = previewCallback(jobs, progressReporter)
+          extraArgs['callback_steps'] = 1
+        # All images of all jobs go through the UNet as one batch
+        result = runModel(
+          pipe,
+          first.device,
+          [job.prompt for job in jobs for _ in range(job.count)],
+          latents = initialLatents(pipe, jobs, first.device),
+          width = first.width,
+          height = first.height,
+          num_inference_steps = first.steps,
+          **extraArgs,
+        )
+    except JobCancelled:
+      for job in jobs:
+        job.complete('cancelled')
+      return
     except Exception as e:
       traceback.print_exc()
-      self.complete('error', error = str(e))
+      for job in jobs:
+        job.complete('error', error = str(e))
+      return
+    dtype = first.loadArgs(first.device)['torch_dtype']
+    outputs = iter(zip(result.images, result.nsfw_content_detected))
+    for job in jobs:
+      flags = []
+      for index in range(job.count):
+        (image, nsfw) = next(outputs)
+        img_data = io.BytesIO()
+        image.save(img_data, "PNG")
+        flags.append(nsfw)
+        if resultCache is not None:
+          try:
+            resultCache.put(job.resultKey(index, dtype), img_data.getvalue(), nsfw)
+          except OSError:
+            # Caching is best effort, the jobs still get their images
+            traceback.print_exc()
+        if job.count > 1:
+          # Streamed as soon as it is encoded instead of with the rest of the job
+          job.partial(index, job.count,
+            data = img_data.getvalue(),
+            type = 'image/png',
+            nsfw = nsfw,
+          )
+      if job.count == 1:
+        job.complete('success',
+          data = img_data.getvalue(),
+          type = 'image/png',
+          nsfw = flags[0],
+          seed = job.seed,
+        )
+      else:
+        job.complete('success', count = job.count, nsfw = flags, seed = job.seed)
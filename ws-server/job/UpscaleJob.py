@@ -1,5 +1,7 @@
+import base64
+import io
 import traceback
-from PIL.Image import Image
+import torch
 from PIL import Image
 
 from .jobParams import UpscaleJobDefinition
@@ -9,85 +11,96 @@ from super_image import (
   ImageLoader
 )
 from ProgressReporter import BaseProgressReporter
-from super_image.models import *
+from super_image.models import get_model_class
+from cancellation import JobCancelled
+from .staging import stagingArea
+from .modelPool import upscaleModels
 
 SCALES = (2, 3, 4)
+TILE_SIZE = 128
+TILE_PAD = 8
+# Relative cost of the heavy architectures, per output megapixel
+MODEL_COST = {
+  "eugenesiow/drln-bam": 4.0,
+  "eugenesiow/drln": 4.0,
+  "eugenesiow/han": 4.0,
+}
 
 ACCEPTED_MODELS = {
   "eugenesiow/drln-bam": {
     "title": "Densely Residual Laplacian Super-Resolution (DRLN-BAM)",
     "ranks": (1, 1, 2),
-    "model": DrlnModel,
+    "modelType": "drln",
   },
   "eugenesiow/edsr": {
     "title": "Enhanced Deep Residual Networks for Single Image Super-Resolution (EDSR)",
     "ranks": (2, 1, 3),
-    "model": EdsrModel,
+    "modelType": "edsr",
   },
   "eugenesiow/msrn": {
     "title": "Multi-scale Residual Network for Image Super-Resolution (MSRN)",
     "ranks": (3, 1, 4),
-    "model": MsrnModel,
+    "modelType": "msrn",
   },
   "eugenesiow/mdsr": {
     "title": "Multi-Scale Deep Super-Resolution System (MDSR)",
     "ranks": (4, 2, 6),
-    "model": MdsrModel,
+    "modelType": "mdsr",
   },
   "eugenesiow/msrn-bam": {
     "title": "Multi-scale Residual Network for Image Super-Resolution (MSRN-BAM)",
     "ranks": (5, 3, 5),
-    "model": MsrnModel,
+    "modelType": "msrn",
   },
   "eugenesiow/edsr-base": {
     "title": "Enhanced Deep Residual Networks for Single Image Super-Resolution (EDSR-BASE)",
     "ranks": (6, 5, 9),
-    "model": EdsrModel,
+    "modelType": "edsr",
   },
   "eugenesiow/mdsr-bam": {
     "title": "Multi-Scale Deep Super-Resolution System (MDSR-BAM)",
     "ranks": (7, 4, 7),
-    "model": MdsrModel,
+    "modelType": "mdsr",
   },
   "eugenesiow/awsrn-bam": {
     "title": "Lightweight Image Super-Resolution with Adaptive Weighted Learning Network (AWSRN-BAM)",
     "ranks": (8, 6, 8),
-    "model": AwsrnModel,
+    "modelType": "awsrn",
   },
   "eugenesiow/a2n": {
     "title": "Attention in Attention Network for Image Super-Resolution (A2N)",
     "ranks": (9, 8, 10),
-    "model": A2nModel,
+    "modelType": "a2n",
   },
   "eugenesiow/carn": {
     "title": "Cascading Residual Network (CARN)",
     "ranks": (10, 7, 11),
-    "model": CarnModel,
+    "modelType": "carn",
   },
   "eugenesiow/carn-bam": {
     "title": "Cascading Residual Network (CARN-BAM)",
     "ranks": (11, 9, 12),
-    "model": CarnModel,
+    "modelType": "carn",
   },
   "eugenesiow/pan": {
     "title": "Pixel Attention Network (PAN)",
     "ranks": (12, 11, 13),
-    "model": PanModel,
+    "modelType": "pan",
   },
   "eugenesiow/pan-bam": {
     "title": "Pixel Attention Network (PAN-BAM)",
     "ranks": (13, 10, 14),
-    "model": PanModel,
+    "modelType": "pan",
   },
   "eugenesiow/drln": {
     "title": "Densely Residual Laplacian Super-Resolution (DRLN)",
     "ranks": (None, None, 1),
-    "model": DrlnModel,
+    "modelType": "drln",
   },
   "eugenesiow/han": {
     "title": "Holistic Attention Network (HAN)",
     "ranks": (None, None, 1),
-    "model": HanModel,
+    "modelType": "han",
   },
 }
 
@@ -97,19 +110,96 @@ class UpscaleJob(BaseJob):
     if (job['model'] not in ACCEPTED_MODELS):
       raise Exception('Invalid model')
     self.model = job['model']
-    self.steps = job['scale'] or 2
+    self.scale = job.get('scale') or 2
+    if (self.scale not in SCALES):
+      raise Exception('Invalid scale')
     self.image = job['image']
+    self.size = self.decodeImage().size
 
-  def run(self):
-    try:
-      print(self.image);
-      image = Image.open('myfile.png')
+  def modelKey(self):
+    return ('upscale', self.model, self.scale)
+
+  def cost(self):
+    (width, height) = self.size
+    megapixels = width * height * self.scale * self.scale / 1e6
+    return megapixels * MODEL_COST.get(self.model, 1.0)
+
+  def estimateKey(self):
+    return ('upscale', self.model, self.scale, *self.size)
+
+  @staticmethod
+  def dtypeFor(device: str) -> torch.dtype:
+    # Half precision on gpus, taken straight from an fp16 export when there is one
+    return torch.float16 if torch.device(device).type == 'cuda' else torch.float32
+
+  def stageKey(self, device: str):
+    # A model staged for a gpu lane is no use to a cpu lane, and vice versa
+    return (*self.modelKey(), str(self.dtypeFor(device)))
 
-      model = PanModel.from_pretrained('eugenesiow/pan-bam', scale=2)
-      inputs = ImageLoader.load_image(image)
-      preds = model(inputs)
+  def loadModel(self, device: str):
+    dtype = self.dtypeFor(device)
+    modelClass = get_model_class(ACCEPTED_MODELS[self.model]['modelType'])
+    return modelClass.from_pretrained(self.model, scale=self.scale, torch_dtype=dtype)
 
-      ImageLoader.save_image(preds, 'myfile_x2.png')
+  def loadStagedModel(self):
+    model = stagingArea.take(self.stageKey(self.device))
+    if model is None:
+      model = self.loadModel(self.device)
+    return model
+
+  def prefetch(self, device: str):
+    if upscaleModels.has(self.modelKey(), device):
+      return None
+    # Small enough to load blind, the staging area remembers the size after
+    return (self.stageKey(device), lambda: self.loadModel(device), None)
+
+  def decodeImage(self) -> Image.Image:
+    data = self.image
+    if isinstance(data, str):
+      data = base64.b64decode(data.split(',')[-1])
+    return Image.open(io.BytesIO(data))
+
+  def run(self):
+    try:
+      self.progressReporter.totalSteps = 2
+      self.progressReporter.setStep(1, 'Preparing Model')
+      with upscaleModels.checkout(self.modelKey(), self.device, self.loadStagedModel) as model:
+        weight = next(model.parameters())
+        inputs = ImageLoader.load_image(self.decodeImage()).to(self.device, dtype=weight.dtype)
+        if weight.dim() == 4 and weight.is_contiguous(memory_format=torch.channels_last):
+          inputs = inputs.contiguous(memory_format=torch.channels_last)
+        self.progressReporter.setStep(2, 'Upscaling Image', True)
+        preds = upscaleTiled(model, inputs, self.scale, self.progressReporter)
+      arr = preds[0].float().clamp(0, 1).mul(255).byte().permute(1, 2, 0).cpu().numpy()
+      img_data = io.BytesIO()
+      Image.fromarray(arr).save(img_data, "PNG")
+      self.complete('success',
+        data = img_data.getvalue(),
+        type = 'image/png',
+      )
+    except JobCancelled:
+      self.complete('cancelled')
     except Exception as e:
       traceback.print_exc()
-      self.complete({ 'status': 'error', 'error': str(e) })
+      self.complete('error', error = str(e))
+
+def upscaleTiled(model, inputs: torch.Tensor, scale: int, progressReporter: BaseProgressReporter, tileSize: int = TILE_SIZE, pad: int = TILE_PAD):
+  """
+  Upscales ``inputs`` tile by tile. Each tile is padded with ``pad`` pixels of
+  context to avoid seams, and cancellation is checked between tiles.
+  """
+  (_, channels, height, width) = inputs.shape
+  output = inputs.new_zeros((1, channels, height * scale, width * scale))
+  tiles = [(y, x) for y in range(0, height, tileSize) for x in range(0, width, tileSize)]
+  for (i, (y, x)) in enumerate(tiles):
+    progressReporter.checkCancelled()
+    (y0, x0) = (max(y - pad, 0), max(x - pad, 0))
+    (y1, x1) = (min(y + tileSize + pad, height), min(x + tileSize + pad, width))
+    (th, tw) = (min(tileSize, height - y), min(tileSize, width - x))
+    with torch.no_grad():
+      pred = model(inputs[:, :, y0:y1, x0:x1])
+    (oy, ox) = ((y - y0) * scale, (x - x0) * scale)
+    output[:, :, y * scale:(y + th) * scale, x * scale:(x + tw) * scale] = \
+      pred[:, :, oy:oy + th * scale, ox:ox + tw * scale]
+    progressReporter.sendProgress((i + 1) / len(tiles) * 100)
+  return output
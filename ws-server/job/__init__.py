@@ -1,5 +1,5 @@
 
-from typing import Literal, TypedDict, Union
+from typing import Literal, Optional, TypedDict, Union
 from uuid import uuid4
 from flask_socketio import SocketIO
 
@@ -9,11 +9,14 @@ from .Txt2ImgJob import Txt2ImgJob
 from .UpscaleJob import UpscaleJob
 from ProgressReporter.SingleJobProgressReporter import ProgressReporter
 
-def make_job(socketio: SocketIO, sid: str, jobDef: JobDefinition) -> BaseJob:
-    id = str(uuid4())
+def make_job(socketio: SocketIO, sid: str, jobDef: JobDefinition, id: Optional[str] = None) -> BaseJob:
+    if id is None:
+        id = str(uuid4())
     if (jobDef['type'] == 'txt2img'):
-        return Txt2ImgJob(sid, id, ProgressReporter(socketio, sid, id), jobDef)
+        job = Txt2ImgJob(sid, id, ProgressReporter(socketio, sid, id), jobDef)
     elif (jobDef['type'] == 'upscale'):
-        return UpscaleJob(sid, id, ProgressReporter(socketio, sid, id), jobDef)
+        job = UpscaleJob(sid, id, ProgressReporter(socketio, sid, id), jobDef)
     else:
-        raise Exception('Invalid job type')
\ No newline at end of file
+        raise Exception('Invalid job type')
+    job.definition = jobDef
+    return job
@@ -10,8 +10,17 @@ class Txt2ImgDefinition(BaseDefinition):
   prompt: str
   model: Optional[str]
   steps: Optional[int]
+  # One of SCHEDULERS in Txt2ImgJob, the pipeline's own scheduler when omitted
+  scheduler: Optional[str]
   width: Optional[int]
   height: Optional[int]
+  # Number of images to generate from the prompt, streamed as job_partial
+  count: Optional[int]
+  # Makes the images reproducible, image i is generated from seed + i
+  seed: Optional[int]
+  # Send a rough job_preview of the images every this many denoising steps,
+  # only allowed for nsfw jobs since previews skip the safety checker
+  preview: Optional[int]
 
 class UpscaleJobDefinition(BaseDefinition):
   type: Literal["upscale"]
@@ -0,0 +1,64 @@
+import os
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable, Hashable, Iterator, Tuple
+
+from torch import nn
+
+from .pipelineCache import moduleBytes
+
+class ModelPool:
+  """
+  Keeps instantiated, eval-mode models around between jobs. A model is checked
+  out by one lane at a time, concurrent checkouts of the same key build extra
+  instances. Idle instances are evicted least recently used first once they
+  hold more than ``budget`` bytes of parameters.
+  """
+
+  def __init__(self, budget: int):
+    self.budget = budget
+    self._idle: 'OrderedDict[Tuple[Hashable, str, int], Tuple[nn.Module, int]]' = OrderedDict()
+    self._lock = Lock()
+    self._serial = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def has(self, key: Hashable, device: str) -> bool:
+    with self._lock:
+      return any(idleKey[:2] == (key, device) for idleKey in self._idle)
+
+  @contextmanager
+  def checkout(self, key: Hashable, device: str, load: Callable[[], nn.Module]) -> Iterator[nn.Module]:
+    with self._lock:
+      entry = next((idleKey for idleKey in self._idle if idleKey[:2] == (key, device)), None)
+      if entry is not None:
+        (model, size) = self._idle.pop(entry)
+        self.hits += 1
+      else:
+        self.misses += 1
+    if entry is None:
+      model = load().to(device).eval()
+      size = moduleBytes(model)
+    try:
+      yield model
+    finally:
+      with self._lock:
+        self._serial += 1
+        self._idle[(key, device, self._serial)] = (model, size)
+        used = sum(idleSize for (_, idleSize) in self._idle.values())
+        while used > self.budget and len(self._idle) > 0:
+          used -= self._idle.popitem(last=False)[1][1]
+          self.evictions += 1
+
+  def stats(self):
+    with self._lock:
+      return {
+        'hits': self.hits,
+        'misses': self.misses,
+        'evictions': self.evictions,
+        'idle': len(self._idle),
+      }
+
+upscaleModels = ModelPool(int(os.environ.get('UPSCALE_CACHE_BYTES', 2 * 1024 ** 3)))
@@ -0,0 +1,144 @@
+import os
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Condition
+from typing import Callable, Hashable, Iterator, Tuple
+from torch import nn, device as torchDevice, cuda
+
+def moduleBytes(target) -> int:
+  """Bytes held by the parameters and buffers of every torch module of a pipeline or model."""
+  if isinstance(target, nn.Module):
+    modules = [target]
+  else:
+    modules = [value for value in vars(target).values() if isinstance(value, nn.Module)]
+  total = 0
+  for module in modules:
+    for tensor in list(module.parameters()) + list(module.buffers()):
+      total += tensor.numel() * tensor.element_size()
+  return total
+
+class PipelineCache:
+  """
+  Process-wide cache of loaded pipelines. A pipeline is checked out by one run
+  at a time, because its scheduler and memory settings are not safe to share.
+  A concurrent checkout of the same key loads an extra instance if the budget
+  of the device has room for it next to the busy ones, and otherwise waits for
+  the busy instance. Idle entries are evicted least recently used first once
+  the pipelines resident on a device exceed its byte budget, ``ramBudget`` for
+  the cpu and ``vramBudget`` for each cuda device.
+  """
+
+  def __init__(self, ramBudget: int, vramBudget: int):
+    self.ramBudget = ramBudget
+    self.vramBudget = vramBudget
+    self._entries: 'OrderedDict[Tuple[Hashable, int], Tuple[object, str, int]]' = OrderedDict()
+    self._busy: 'set[Tuple[Hashable, int]]' = set()
+    self._loading: 'set[Hashable]' = set()
+    self._cond = Condition()
+    self._serial = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.waits = 0
+
+  def budgetFor(self, device: str) -> int:
+    return self.vramBudget if torchDevice(device).type == 'cuda' else self.ramBudget
+
+  def __contains__(self, key: Hashable) -> bool:
+    with self._cond:
+      return any(entryKey[0] == key for entryKey in self._entries)
+
+  def _fits(self, key: Hashable, device: str) -> bool:
+    """Whether another instance of ``key`` fits next to the busy pipelines of ``device``."""
+    sizes = [size for ((entryKey, _), (_, _, size)) in self._entries.items() if entryKey == key]
+    if len(sizes) == 0:
+      # The first instance always loads, evicting whatever it has to
+      return True
+    busy = sum(size for (entryKey, (_, entryDevice, size)) in self._entries.items() if entryDevice == device and entryKey in self._busy)
+    return busy + sizes[0] <= self.budgetFor(device)
+
+  @contextmanager
+  def checkout(self, key: Hashable, device: str, load: Callable[[], object]) -> Iterator[Tuple[object, bool]]:
+    """Yields ``(pipeline, hit)`` for exclusive use, calling ``load`` when no idle instance is cached."""
+    with self._cond:
+      waited = False
+      while True:
+        entryKey = next(
+          (entryKey for entryKey in self._entries if entryKey[0] == key and entryKey not in self._busy),
+          None,
+        )
+        if entryKey is not None:
+          pipe = self._entries[entryKey][0]
+          self._entries.move_to_end(entryKey)
+          self._busy.add(entryKey)
+          self.hits += 1
+          break
+        if key not in self._loading and self._fits(key, device):
+          self._loading.add(key)
+          self.misses += 1
+          break
+        # Another run is loading this pipeline, or holds the only instance
+        # the budget has room for
+        if not waited:
+          self.waits += 1
+          waited = True
+        self._cond.wait()
+    hit = entryKey is not None
+    if not hit:
+      try:
+        pipe = load()
+        size = moduleBytes(pipe)
+      except BaseException:
+        with self._cond:
+          self._loading.discard(key)
+          self._cond.notify_all()
+        raise
+      with self._cond:
+        self._loading.discard(key)
+        self._evict(device, self.budgetFor(device) - size)
+        self._serial += 1
+        entryKey = (key, self._serial)
+        self._entries[entryKey] = (pipe, device, size)
+        self._busy.add(entryKey)
+        self._cond.notify_all()
+    try:
+      yield (pipe, hit)
+    finally:
+      with self._cond:
+        self._busy.discard(entryKey)
+        # Extra instances from concurrent checkouts may have pushed the device
+        # over its budget while they were busy.
+        self._evict(device, self.budgetFor(device))
+        self._cond.notify_all()
+
+  def _evict(self, device: str, budget: int):
+    resident = [entryKey for (entryKey, (_, entryDevice, _)) in self._entries.items() if entryDevice == device]
+    used = sum(self._entries[entryKey][2] for entryKey in resident)
+    evicted = False
+    for entryKey in resident:
+      if used <= budget:
+        break
+      if entryKey in self._busy:
+        continue
+      used -= self._entries.pop(entryKey)[2]
+      self.evictions += 1
+      evicted = True
+    if evicted and torchDevice(device).type == 'cuda':
+      cuda.empty_cache()
+
+  def stats(self):
+    with self._cond:
+      return {
+        'hits': self.hits,
+        'misses': self.misses,
+        'evictions': self.evictions,
+        'waits': self.waits,
+        'entries': len(self._entries),
+        'busy': len(self._busy),
+        'bytes': sum(size for (_, _, size) in self._entries.values()),
+      }
+
+pipelineCache = PipelineCache(
+  int(os.environ.get('PIPELINE_CACHE_RAM_BYTES', 16 * 1024 ** 3)),
+  int(os.environ.get('PIPELINE_CACHE_VRAM_BYTES', 8 * 1024 ** 3)),
+)
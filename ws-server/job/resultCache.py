@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+from threading import Lock
+from typing import Hashable, Optional, Tuple
+
+class ResultCache:
+  """
+  Content-addressed cache of generated images on disk, keyed by everything
+  that determines the image. Files are named after the hash of their key, so
+  lane processes can share the directory with the server. Reading an entry
+  touches its file, and the least recently used files are deleted once the
+  directory holds more than ``capacity`` bytes.
+  """
+
+  def __init__(self, directory: str, capacity: int):
+    self.directory = directory
+    self.capacity = capacity
+    self._lock = Lock()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    os.makedirs(directory, exist_ok=True)
+
+  def _paths(self, key: Hashable) -> Tuple[str, str]:
+    digest = hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest()
+    base = os.path.join(self.directory, digest)
+    # The nsfw flag of an image is part of its file name
+    return (f'{base}.png', f'{base}.nsfw.png')
+
+  def get(self, key: Hashable) -> Optional[Tuple[bytes, bool]]:
+    """Returns ``(png, nsfw)`` of a cached image."""
+    for (path, nsfw) in zip(self._paths(key), (False, True)):
+      try:
+        with open(path, 'rb') as reader:
+          data = reader.read()
+      except FileNotFoundError:
+        continue
+      try:
+        os.utime(path)
+      except OSError:
+        # Evicted by someone else in the meantime, the bytes are still good
+        pass
+      with self._lock:
+        self.hits += 1
+      return (data, nsfw)
+    with self._lock:
+      self.misses += 1
+    return None
+
+  def put(self, key: Hashable, data: bytes, nsfw: bool):
+    if len(data) > self.capacity:
+      return
+    path = self._paths(key)[1 if nsfw else 0]
+    temp = f'{path}.{os.getpid()}.tmp'
+    with open(temp, 'wb') as writer:
+      writer.write(data)
+    os.replace(temp, path)
+    self._evict()
+
+  def _evict(self):
+    with self._lock:
+      entries = []
+      for entry in os.scandir(self.directory):
+        if entry.name.endswith('.png'):
+          try:
+            stat = entry.stat()
+          except FileNotFoundError:
+            continue
+          entries.append((stat.st_mtime, stat.st_size, entry.path))
+      used = sum(size for (_, size, _) in entries)
+      for (_, size, path) in sorted(entries):
+        if used <= self.capacity:
+          break
+        try:
+          os.remove(path)
+        except FileNotFoundError:
+          pass
+        used -= size
+        self.evictions += 1
+
+  def stats(self):
+    with self._lock:
+      return {
+        'hits': self.hits,
+        'misses': self.misses,
+        'evictions': self.evictions,
+      }
+
+# Disabled unless a directory is configured
+resultCache: Optional[ResultCache] = None
+if os.environ.get('RESULT_CACHE_DIR'):
+  resultCache = ResultCache(
+    os.environ['RESULT_CACHE_DIR'],
+    int(os.environ.get('RESULT_CACHE_BYTES', 2 * 1024 ** 3)),
+  )
@@ -0,0 +1,82 @@
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Collection, Hashable, Optional, Tuple
+
+from .pipelineCache import moduleBytes
+
+class StagingArea:
+  """
+  Holds models that were loaded into cpu memory ahead of time for queued jobs.
+  A job takes its model out of the staging area instead of loading it, and the
+  load time it saved that way is added to ``hiddenSeconds``.
+  """
+
+  def __init__(self, capacity: int):
+    self.capacity = capacity
+    self._entries: 'OrderedDict[Hashable, Tuple[object, int, float]]' = OrderedDict()
+    # Measured size of every model staged before, staged or not
+    self._sizes: 'dict[Hashable, int]' = {}
+    self._lock = Lock()
+    self.hits = 0
+    self.hiddenSeconds = 0.0
+
+  def __contains__(self, key: Hashable) -> bool:
+    with self._lock:
+      return key in self._entries
+
+  def stage(self, key: Hashable, load: Callable[[], object], estimate: Optional[int] = None, keep: Collection[Hashable] = ()) -> bool:
+    """
+    Loads and stages a model, returns whether it fit into the capacity. Room
+    is made before loading, going by the size the model had when it was last
+    loaded or else by ``estimate``, so a model that doesn't fit is never
+    loaded. Entries in ``keep`` are never evicted to make room.
+    """
+    with self._lock:
+      if key in self._entries:
+        return True
+      size = self._sizes.get(key, estimate)
+      if size is not None and not self._makeRoom(size, keep):
+        return False
+    start = time.monotonic()
+    model = load()
+    seconds = time.monotonic() - start
+    size = moduleBytes(model)
+    with self._lock:
+      self._sizes[key] = size
+      if not self._makeRoom(size, keep):
+        return False
+      self._entries[key] = (model, size, seconds)
+    return True
+
+  def _makeRoom(self, size: int, keep: Collection[Hashable]) -> bool:
+    used = sum(entry[1] for entry in self._entries.values())
+    evictable = [key for key in self._entries if key not in keep]
+    if used - sum(self._entries[key][1] for key in evictable) + size > self.capacity:
+      return False
+    for key in evictable:
+      if used + size <= self.capacity:
+        break
+      used -= self._entries.pop(key)[1]
+    return True
+
+  def stats(self):
+    with self._lock:
+      return {
+        'hits': self.hits,
+        'hiddenSeconds': self.hiddenSeconds,
+        'entries': len(self._entries),
+        'bytes': sum(entry[1] for entry in self._entries.values()),
+      }
+
+  def take(self, key: Hashable) -> Optional[object]:
+    with self._lock:
+      entry = self._entries.pop(key, None)
+      if entry is None:
+        return None
+      self.hits += 1
+      self.hiddenSeconds += entry[2]
+      return entry[0]
+
+stagingArea = StagingArea(int(os.environ.get('PREFETCH_BYTES', 8 * 1024 ** 3)))
@@ -1,15 +1,22 @@
 
+import copy
 import os
+import time
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Optional, Union
+from threading import Lock
+from typing import TYPE_CHECKING, Callable, Hashable, Iterator, List, Optional, Tuple, Union
 from huggingface_hub.file_download import REGEX_COMMIT_HASH, repo_folder_name
 from huggingface_hub.constants import DEFAULT_REVISION, REPO_TYPES, HUGGINGFACE_HUB_CACHE
 from huggingface_hub.utils import filter_repo_objects
 from huggingface_hub.hf_api import HfApi, HfFolder
 from huggingface_hub import snapshot_download
-from diffusers.utils import DIFFUSERS_CACHE
-from diffusers import DiffusionPipeline
 from ProgressReporter import BaseProgressReporter
+from .pipelineCache import pipelineCache
+from .staging import stagingArea
+
+if TYPE_CHECKING:
+    from diffusers import DiffusionPipeline
 
 def checkHasFile(
     repo_id: str,
@@ -75,6 +82,46 @@ def checkHasFile(
 
     return os.path.exists(pointer_path)
 
+class RevisionCache:
+    """
+    Remembers which commit a revision resolved to, and which snapshot folders
+    were found complete on disk, so that warm lookups don't hit the network or
+    the filesystem. Revision resolutions expire after ``ttl`` seconds, complete
+    snapshots never do since a commit's files can't change.
+    """
+
+    def __init__(self, ttl: float, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._revisions: "dict[Hashable, Tuple[float, str, List[str]]]" = {}
+        self._complete: "set[Hashable]" = set()
+        self._lock = Lock()
+
+    def getRevision(self, key: Hashable, allow_stale: bool = False) -> Optional[Tuple[str, List[str]]]:
+        with self._lock:
+            entry = self._revisions.get(key)
+            if entry is None or (entry[0] < self.clock() and not allow_stale):
+                return None
+            return (entry[1], entry[2])
+
+    def putRevision(self, key: Hashable, commit_hash: str, files: List[str]):
+        with self._lock:
+            self._revisions[key] = (self.clock() + self.ttl, commit_hash, files)
+
+    def isComplete(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._complete
+
+    def markComplete(self, key: Hashable):
+        with self._lock:
+            self._complete.add(key)
+
+    def forgetComplete(self, key: Hashable):
+        with self._lock:
+            self._complete.discard(key)
+
+revisionCache = RevisionCache(float(os.environ.get("REVISION_CACHE_TTL", 600)))
+
 def getExistingPretrainedPathIfExisting(
     repo_id: str,
     *,
@@ -87,6 +134,8 @@ def getExistingPretrainedPathIfExisting(
     ignore_regex: Optional[Union[List[str], str]] = None,
     allow_patterns: Optional[Union[List[str], str]] = None,
     ignore_patterns: Optional[Union[List[str], str]] = None,
+    api: Optional[HfApi] = None,
+    cache: Optional[RevisionCache] = None,
 ):
     if cache_dir is None:
         cache_dir = HUGGINGFACE_HUB_CACHE
@@ -94,6 +143,8 @@ def getExistingPretrainedPathIfExisting(
         revision = DEFAULT_REVISION
     if isinstance(cache_dir, Path):
         cache_dir = str(cache_dir)
+    if cache is None:
+        cache = revisionCache
 
     if isinstance(use_auth_token, str):
         token = use_auth_token
@@ -153,21 +204,41 @@ def getExistingPretrainedPathIfExisting(
             " False."
         )
 
-    # if we have internet connection we retrieve the correct folder name from the huggingface api
-    _api = HfApi()
-    repo_info = _api.repo_info(
-        repo_id=repo_id, repo_type=repo_type, revision=revision, token=token
-    )
-    filtered_repo_files = filter_repo_objects(
-        items=[f.rfilename for f in repo_info.siblings],
+    # if we have internet connection we retrieve the correct folder name from the huggingface api,
+    # unless the revision was resolved recently
+    revision_key = (cache_dir, repo_type, repo_id, revision)
+    resolved = cache.getRevision(revision_key)
+    if resolved is None:
+        _api = api if api is not None else HfApi()
+        try:
+            repo_info = _api.repo_info(
+                repo_id=repo_id, repo_type=repo_type, revision=revision, token=token
+            )
+        except Exception:
+            # Fall back to the last known resolution when the hub can't be reached
+            resolved = cache.getRevision(revision_key, allow_stale=True)
+            if resolved is None:
+                raise
+        else:
+            commit_hash = repo_info.sha
+            if (commit_hash is None):
+              return None
+            resolved = (commit_hash, [f.rfilename for f in repo_info.siblings])
+            cache.putRevision(revision_key, *resolved)
+    (commit_hash, repo_files) = resolved
+    filtered_repo_files = list(filter_repo_objects(
+        items=repo_files,
         allow_patterns=allow_patterns,
         ignore_patterns=ignore_patterns,
-    )
-    commit_hash = repo_info.sha
-    if (commit_hash is None):
-      return None
+    ))
     snapshot_folder = os.path.join(storage_folder, "snapshots", commit_hash)
 
+    complete_key = (snapshot_folder, tuple(filtered_repo_files))
+    if cache.isComplete(complete_key):
+        # The snapshot may have been pruned from the hub cache since
+        if os.path.isdir(snapshot_folder):
+            return snapshot_folder
+        cache.forgetComplete(complete_key)
     for repo_file in filtered_repo_files:
         if not checkHasFile(
             repo_id,
@@ -177,9 +248,38 @@ def getExistingPretrainedPathIfExisting(
             cache_dir=cache_dir,
         ):
             return None
+    cache.markComplete(complete_key)
     return snapshot_folder
 
-def loadModel(Pipeline: DiffusionPipeline, pretrained_model_name_or_path: Optional[Union[str, os.PathLike]], progressReporter: BaseProgressReporter, **kwargs):
+# Pipelines written by exportPipeline, already cast to the dtype in their name
+PIPELINE_EXPORT_DIR = os.environ.get("PIPELINE_EXPORT_DIR", os.path.join(HUGGINGFACE_HUB_CACHE, "exported"))
+
+def exportedPipelinePath(pretrained_model_name_or_path: str, torch_dtype) -> str:
+  dtypeName = str(torch_dtype).split(".")[-1]
+  return os.path.join(PIPELINE_EXPORT_DIR, f"{pretrained_model_name_or_path.replace('/', '--')}.{dtypeName}")
+
+def exportPipeline(Pipeline: 'DiffusionPipeline', pretrained_model_name_or_path: str, torch_dtype, **kwargs) -> str:
+  """
+  Saves a pipeline with every component cast to ``torch_dtype``, which
+  :func:`loadModel` then prefers over the original, full precision weights.
+  """
+  from ProgressReporter.NullProgressReporter import NullProgressReporter
+  pipe = loadModel(Pipeline, pretrained_model_name_or_path, NullProgressReporter(), torch_dtype=torch_dtype, **kwargs)
+  path = exportedPipelinePath(pretrained_model_name_or_path, torch_dtype)
+  pipe.save_pretrained(path)
+  return path
+
+def loadModel(Pipeline: 'DiffusionPipeline', pretrained_model_name_or_path: Optional[Union[str, os.PathLike]], progressReporter: BaseProgressReporter, **kwargs):
+  exported = exportedPipelinePath(str(pretrained_model_name_or_path), kwargs.get("torch_dtype"))
+  if os.path.isfile(os.path.join(exported, "model_index.json")):
+    # Stored in torch_dtype already, nothing to verify, download or convert
+    kwargs.pop("use_auth_token", None)
+    kwargs.pop("local_files_only", None)
+    progressReporter.totalSteps = 2
+    progressReporter.setStep(1, 'Preparing Model')
+    pipe = Pipeline.from_pretrained(exported, local_files_only = True, **kwargs)
+    progressReporter.attachToDiffusionPipeline(pipe)
+    return pipe
   if not os.path.isdir(pretrained_model_name_or_path):
     local_files_only = kwargs.pop("local_files_only", False)
     if local_files_only:
@@ -192,6 +292,7 @@ def loadModel(Pipeline: DiffusionPipeline, pretrained_model_name_or_path: Option
       )
       progressReporter.attachToDiffusionPipeline(pipe)
       return pipe
+    from diffusers.utils import DIFFUSERS_CACHE
     cache_dir = kwargs.pop("cache_dir", DIFFUSERS_CACHE)
     local_files_only = kwargs.pop("local_files_only", False)
     use_auth_token = kwargs.pop("use_auth_token", None)
@@ -249,3 +350,39 @@ def loadModel(Pipeline: DiffusionPipeline, pretrained_model_name_or_path: Option
     pipe = Pipeline.from_pretrained(pretrained_model_name_or_path, **kwargs)
     progressReporter.attachToDiffusionPipeline(pipe)
     return pipe
+
+def pipelineKeys(pretrained_model_name_or_path: str, torch_dtype, device: str, variant: str = 'default'):
+  """Returns the pipeline cache key and the staging area key of a pipeline."""
+  stageKey = (pretrained_model_name_or_path, str(torch_dtype), variant)
+  return ((*stageKey, device), stageKey)
+
+@contextmanager
+def checkoutCachedModel(Pipeline: 'DiffusionPipeline', pretrained_model_name_or_path: str, progressReporter: BaseProgressReporter, *, device: str, variant: str = 'default', **kwargs) -> Iterator['DiffusionPipeline']:
+  """
+  Like :func:`loadModel`, but keeps the pipeline resident on ``device`` in the
+  process-wide pipeline cache and has the caller's run use it exclusively.
+  ``variant`` distinguishes pipelines of the same model that are loaded with
+  different components. A pipeline prefetched into the staging area only
+  needs to be moved to ``device``.
+
+  Yields a shallow copy of the cached pipeline that reports its progress to
+  ``progressReporter``, so the progress bar or scheduler of a run can be
+  swapped without touching the cached pipeline.
+  """
+  (key, stageKey) = pipelineKeys(pretrained_model_name_or_path, kwargs.get('torch_dtype'), device, variant)
+
+  def load():
+    pipe = stagingArea.take(stageKey)
+    if pipe is None:
+      pipe = loadModel(Pipeline, pretrained_model_name_or_path, progressReporter, **kwargs)
+    else:
+      progressReporter.totalSteps = 2
+      progressReporter.setStep(1, 'Preparing Model')
+    return pipe.to(device)
+
+  with pipelineCache.checkout(key, device, load) as (pipe, hit):
+    if hit:
+      progressReporter.totalSteps = 1
+    pipe = copy.copy(pipe)
+    progressReporter.attachToDiffusionPipeline(pipe)
+    yield pipe
@@ -0,0 +1,137 @@
+import base64
+import json
+import os
+import sqlite3
+import time
+from threading import Condition, Thread
+from typing import TYPE_CHECKING, Any, Optional, Tuple
+
+if TYPE_CHECKING:
+  from job import BaseJob
+
+def encodeBinary(value: Any) -> str:
+  # Binary uploads are stored the way clients may send them as text, as base64
+  if isinstance(value, (bytes, bytearray)):
+    return base64.b64encode(value).decode('ascii')
+  raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+class JobJournal:
+  """
+  Append-only SQLite log of job definitions and their lifecycle, used to
+  replay unfinished jobs after a restart once their user reconnects.
+
+  Records are buffered in memory and written by a background thread in
+  batches, so journaling never blocks ``enqueueJob`` on disk I/O. Jobs first
+  enqueued more than ``maxAge`` seconds ago are not replayed anymore.
+  """
+
+  def __init__(self, path: str, flushInterval: float = 0.05, maxAge: float = float('inf')):
+    self.path = path
+    self.flushInterval = flushInterval
+    self.maxAge = maxAge
+    self._buffer: 'list[Tuple[str, str, Optional[str], Optional[str], float]]' = []
+    self._cond = Condition()
+    self._closed = False
+    directory = os.path.dirname(path)
+    if directory != '':
+      os.makedirs(directory, exist_ok=True)
+    with self._connect() as conn:
+      conn.execute(
+        'CREATE TABLE IF NOT EXISTS events ('
+        ' jobId TEXT NOT NULL,'
+        ' event TEXT NOT NULL,'
+        ' owner TEXT,'
+        ' definition TEXT,'
+        ' at REAL NOT NULL'
+        ')'
+      )
+      conn.execute('CREATE INDEX IF NOT EXISTS events_job ON events (jobId)')
+    self._thread = Thread(target=self._run, daemon=True)
+    self._thread.start()
+
+  def _connect(self) -> sqlite3.Connection:
+    conn = sqlite3.connect(self.path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+  def _append(self, jobId: str, event: str, owner: Optional[str] = None, definition: Any = None):
+    encoded = json.dumps(definition, default=encodeBinary) if definition is not None else None
+    with self._cond:
+      self._buffer.append((jobId, event, owner, encoded, time.time()))
+      self._cond.notify()
+
+  def enqueued(self, job: 'BaseJob'):
+    self._append(job.id, 'enqueued', job.owner, job.definition)
+
+  def started(self, job: 'BaseJob'):
+    self._append(job.id, 'started')
+
+  def completed(self, job: 'BaseJob'):
+    self.discard(job.id)
+
+  def discard(self, jobId: str):
+    """Marks a job that won't run, e.g. one that failed to replay, as done for good."""
+    self._append(jobId, 'completed')
+
+  def expired(self, enqueuedAt: float) -> bool:
+    return enqueuedAt < time.time() - self.maxAge
+
+  def pending(self) -> 'dict[str, list[Tuple[str, Any, float]]]':
+    """
+    Returns the unexpired jobs that were enqueued but never completed, as
+    ``(jobId, jobDef, enqueuedAt)`` lists keyed by owner, and compacts the
+    journal.
+    """
+    pending: 'dict[str, list[Tuple[str, Any, float]]]' = {}
+    cutoff = time.time() - self.maxAge
+    with self._connect() as conn:
+      rows = conn.execute(
+        'SELECT jobId, owner, definition, MIN(at) FROM events'
+        ' WHERE event = \'enqueued\' AND jobId NOT IN'
+        ' (SELECT jobId FROM events WHERE event = \'completed\')'
+        # Replayed jobs are journaled again under the same id
+        ' GROUP BY jobId HAVING MIN(at) >= ? ORDER BY MIN(at)',
+        (cutoff,),
+      ).fetchall()
+      conn.execute(
+        'DELETE FROM events WHERE jobId IN'
+        ' (SELECT jobId FROM events WHERE event = \'completed\')'
+        ' OR jobId IN'
+        ' (SELECT jobId FROM events WHERE event = \'enqueued\' GROUP BY jobId HAVING MIN(at) < ?)',
+        (cutoff,),
+      )
+    for (jobId, owner, definition, enqueuedAt) in rows:
+      try:
+        jobDef = json.loads(definition)
+      except (TypeError, ValueError):
+        # Written by an older version in another format
+        self.discard(jobId)
+        continue
+      pending.setdefault(owner, []).append((jobId, jobDef, enqueuedAt))
+    return pending
+
+  def _run(self):
+    conn = self._connect()
+    while True:
+      with self._cond:
+        while len(self._buffer) == 0 and not self._closed:
+          self._cond.wait()
+        closed = self._closed
+      if not closed:
+        # Give a burst of enqueues the chance to land in the same transaction.
+        time.sleep(self.flushInterval)
+      with self._cond:
+        (batch, self._buffer) = (self._buffer, [])
+      if len(batch) > 0:
+        with conn:
+          conn.executemany('INSERT INTO events VALUES (?, ?, ?, ?, ?)', batch)
+      if closed:
+        conn.close()
+        return
+
+  def close(self):
+    with self._cond:
+      self._closed = True
+      self._cond.notify()
+    self._thread.join()
@@ -0,0 +1,98 @@
+import traceback
+from multiprocessing.connection import Connection
+from threading import Lock, Thread
+from queue import Queue
+from typing import Any, Optional
+
+def configureDevice(device: str, threads: Optional[int] = None):
+  import torch
+  if device.startswith('cuda'):
+    torch.cuda.set_device(torch.device(device))
+  elif threads is not None:
+    # The intra-op thread count is process-wide: thread lanes share one
+    # count, only lane processes get a slice of the cores each.
+    torch.set_num_threads(threads)
+
+def cacheStats() -> dict:
+  """Hit, miss and eviction counts of the model and result caches of this process."""
+  from job.pipelineCache import pipelineCache
+  from job.modelPool import upscaleModels
+  from job.staging import stagingArea
+  from job.resultCache import resultCache
+  return {
+    'pipelines': pipelineCache.stats(),
+    'upscaleModels': upscaleModels.stats(),
+    'staging': stagingArea.stats(),
+    'results': resultCache.stats() if resultCache is not None else None,
+  }
+
+class PipeEmitter:
+  """
+  Stands in for the ``SocketIO`` instance inside a lane process, forwarding
+  every emit to the server process, which re-emits it to the client.
+  """
+
+  def __init__(self, conn: Connection):
+    self.conn = conn
+    self.lock = Lock()
+
+  def emit(self, event: str, *args: Any, to: Optional[str] = None):
+    self.send(('emit', event, args, to))
+
+  def send(self, message: tuple):
+    with self.lock:
+      self.conn.send(message)
+
+def runLaneProcess(conn: Connection, device: str, threads: Optional[int] = None):
+  """
+  Entry point of a spawned lane process. Receives batches of
+  ``(sid, jobId, jobDef)`` from the server process, runs them and reports
+  ``('done', stats)`` after each batch, with the :func:`cacheStats` of the
+  process. Cancellations can arrive while a batch runs.
+  """
+  from job import make_job, BaseJob
+
+  configureDevice(device, threads)
+  emitter = PipeEmitter(conn)
+  batches: 'Queue[Optional[list[tuple]]]' = Queue()
+  running: 'dict[str, BaseJob]' = {}
+  cancelled: 'set[str]' = set()
+
+  def receive():
+    while True:
+      try:
+        message = conn.recv()
+      except EOFError:
+        message = ('stop',)
+      if message[0] == 'run':
+        batches.put(message[1])
+      elif message[0] == 'cancel':
+        cancelled.add(message[1])
+        job = running.get(message[1])
+        if job is not None:
+          job.cancel()
+      elif message[0] == 'stop':
+        batches.put(None)
+        return
+
+  Thread(target=receive, daemon=True).start()
+  while True:
+    specs = batches.get()
+    if specs is None:
+      break
+    try:
+      jobs = [make_job(emitter, sid, jobDef, id=jobId) for (sid, jobId, jobDef) in specs]
+      for job in jobs:
+        job.device = device
+        running[job.id] = job
+        if job.id in cancelled:
+          job.cancel()
+      if len(jobs) == 1:
+        jobs[0].run()
+      else:
+        type(jobs[0]).runBatch(jobs)
+    except Exception:
+      traceback.print_exc()
+    running.clear()
+    cancelled.clear()
+    emitter.send(('done', cacheStats()))
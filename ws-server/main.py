@@ -1,5 +1,5 @@
-from app import app, socketio, backgroundWorker
-
 if __name__=='__main__':
+  # Imported under the guard so spawned lane processes don't start a server of their own
+  from app import app, socketio, backgroundWorker
   socketio.run(app, port=5000)
   backgroundWorker.stop()
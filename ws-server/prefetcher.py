@@ -0,0 +1,60 @@
+import traceback
+from threading import Event
+from typing import TYPE_CHECKING
+
+from job.staging import stagingArea
+
+if TYPE_CHECKING:
+  from worker import Worker
+
+class Prefetcher:
+  """
+  Side task that looks at the next ``depth`` queued jobs and loads their
+  models into the staging area while the lanes are busy, so the load time
+  overlaps with the jobs that are currently running.
+  """
+
+  def __init__(self, worker: 'Worker', depth: int):
+    self.worker = worker
+    self.depth = depth
+    self.wakeup = Event()
+    self.stopping = False
+    self.thread = None
+
+  def start(self):
+    self.thread = self.worker.socketio.start_background_task(target=self)
+
+  def notify(self):
+    self.wakeup.set()
+
+  def stop(self):
+    self.stopping = True
+    self.wakeup.set()
+    self.thread.join()
+
+  def __call__(self):
+    device = self.worker.lanes[0].device
+    while not self.stopping:
+      self.wakeup.wait()
+      self.wakeup.clear()
+      specs = {}
+      for job in self.worker.queue.snapshot()[:self.depth]:
+        try:
+          spec = job.prefetch(device)
+        except Exception:
+          traceback.print_exc()
+          continue
+        if spec is not None:
+          specs.setdefault(spec[0], spec)
+      # Models of the peeked jobs never evict each other, which would have
+      # them reloaded on every wakeup
+      for (key, load, estimate) in specs.values():
+        if self.stopping:
+          break
+        try:
+          stagingArea.stage(key, load, estimate, keep = specs.keys())
+        except Exception:
+          traceback.print_exc()
+
+  def stats(self):
+    return stagingArea.stats()
@@ -0,0 +1,204 @@
+import heapq
+from collections import OrderedDict, deque
+from threading import Condition
+from time import monotonic
+from typing import TYPE_CHECKING, Hashable, Iterator, Literal, Optional, Tuple, Union
+
+if TYPE_CHECKING:
+  from job import BaseJob
+
+QueueItem = Union['BaseJob', Literal['stop']]
+
+class FairShareQueue:
+  """
+  Drop-in replacement for ``queue.Queue`` that round-robins between owners
+  (the JWT uid of a session, or its sid when no uid is known) instead of
+  serving jobs in global FIFO order. Jobs of the same owner keep their FIFO
+  order relative to each other.
+
+  ``get`` can be given the model key of the job a lane ran last, in which case
+  a later job that uses the same model is preferred over the head of the
+  queue. A job can be overtaken like that at most ``maxOvertakes`` times.
+  """
+
+  # ETA changes smaller than this many seconds are not worth a queue update
+  ETA_TOLERANCE = 5.0
+
+  def __init__(self, maxOvertakes: int = 4):
+    self._owners: 'OrderedDict[str, deque[BaseJob]]' = OrderedDict()
+    self._size = 0
+    self._stops = 0
+    self._unfinished = 0
+    self._cond = Condition()
+    self.maxOvertakes = maxOvertakes
+    self.switchesAvoided = 0
+
+  def put(self, item: QueueItem) -> int:
+    """Enqueues an item and returns its current 1-based position in the queue."""
+    with self._cond:
+      self._unfinished += 1
+      if item == 'stop':
+        self._stops += 1
+        self._cond.notify()
+        return 0
+      owner = item.owner
+      jobs = self._owners.get(owner)
+      if jobs is None:
+        jobs = self._owners[owner] = deque()
+      jobs.append(item)
+      self._size += 1
+      # Lanes waiting to fill a batch are waiting on the same condition.
+      self._cond.notify_all()
+      item.queuePos = self._positionOf(owner, len(jobs) - 1)
+      return item.queuePos
+
+  def get(self, affinity: Optional[Hashable] = None) -> QueueItem:
+    with self._cond:
+      while self._size == 0 and self._stops == 0:
+        self._cond.wait()
+      if self._stops > 0:
+        self._stops -= 1
+        return 'stop'
+      (owner, depth) = self._pick(affinity)
+      jobs = self._owners[owner]
+      job = jobs[depth]
+      del jobs[depth]
+      self._size -= 1
+      if len(jobs) == 0:
+        del self._owners[owner]
+      else:
+        self._owners.move_to_end(owner)
+      return job
+
+  def takeCompatible(self, batchKey: Hashable, limit: int, window: float = 0) -> 'list[BaseJob]':
+    """
+    Removes queued jobs whose batch key equals ``batchKey`` as long as their
+    ``batchSize`` adds up to at most ``limit``, waiting at most ``window``
+    seconds for more of them to arrive.
+    """
+    taken: 'list[BaseJob]' = []
+    size = 0
+    deadline = monotonic() + window
+    with self._cond:
+      while True:
+        matches = []
+        for (owner, _, job) in self._order():
+          if job.batchKey() == batchKey and size + job.batchSize() <= limit:
+            matches.append((owner, job))
+            size += job.batchSize()
+        for (owner, job) in matches:
+          jobs = self._owners[owner]
+          jobs.remove(job)
+          if len(jobs) == 0:
+            del self._owners[owner]
+        self._size -= len(matches)
+        taken.extend(job for (_, job) in matches)
+        remaining = deadline - monotonic()
+        if size >= limit or remaining <= 0 or self._stops > 0:
+          return taken
+        self._cond.wait(remaining)
+
+  def remove(self, job: 'BaseJob') -> bool:
+    """Removes a job that is still queued, returning False if a lane already took it."""
+    with self._cond:
+      jobs = self._owners.get(job.owner)
+      if jobs is None or job not in jobs:
+        return False
+      jobs.remove(job)
+      self._size -= 1
+      if len(jobs) == 0:
+        del self._owners[job.owner]
+      return True
+
+  def task_done(self):
+    with self._cond:
+      self._unfinished -= 1
+
+  def qsize(self) -> int:
+    with self._cond:
+      return self._size
+
+  def snapshot(self) -> 'list[BaseJob]':
+    """Returns the queued jobs in fair-share order, before any affinity reordering."""
+    with self._cond:
+      return [job for (_, _, job) in self._order()]
+
+  def changedPositions(self, laneFreeAt: 'Optional[list[float]]' = None) -> 'dict[str, list[BaseJob]]':
+    """
+    Returns the jobs whose position changed since it was last reported,
+    grouped by sid, and records the new positions.
+
+    Given the times at which each lane becomes free, it also assigns every
+    job an ``eta`` of ``(startsAt, finishesAt)`` from the jobs' ``estimate``,
+    and reports jobs whose ETA moved by more than ``ETA_TOLERANCE``.
+
+    This walks the whole queue under the lock, so every call is O(n) and
+    filling the queue one job at a time is O(n^2) overall. Only the emits are
+    limited to the jobs that changed. Tracking positions per owner wouldn't
+    remove the walk, because a job's ETA depends on the estimates of all jobs
+    ahead of it.
+    """
+    changes: 'dict[str, list[BaseJob]]' = {}
+    lanes = list(laneFreeAt) if laneFreeAt else None
+    if lanes is not None:
+      heapq.heapify(lanes)
+    with self._cond:
+      for (pos, (_, _, job)) in enumerate(self._order(), 1):
+        changed = job.queuePos != pos
+        if lanes is not None:
+          startsAt = heapq.heappop(lanes)
+          finishesAt = startsAt + job.estimate
+          heapq.heappush(lanes, finishesAt)
+          if job.eta is None or abs(job.eta[0] - startsAt) > self.ETA_TOLERANCE:
+            changed = True
+          if changed:
+            job.eta = (startsAt, finishesAt)
+        if changed:
+          job.queuePos = pos
+          changes.setdefault(job.sid, []).append(job)
+    return changes
+
+  def _order(self) -> Iterator[Tuple[str, int, 'BaseJob']]:
+    # Owners drop out of the rotation once their backlog is exhausted, which
+    # keeps a full walk O(n) even with one deep backlog among many shallow ones.
+    active = [(owner, iter(jobs)) for (owner, jobs) in self._owners.items()]
+    depth = 0
+    while len(active) > 0:
+      remaining = []
+      for (owner, jobs) in active:
+        job = next(jobs, None)
+        if job is not None:
+          yield (owner, depth, job)
+          remaining.append((owner, jobs))
+      active = remaining
+      depth += 1
+
+  def _pick(self, affinity: Optional[Hashable]) -> Tuple[str, int]:
+    order = self._order()
+    (owner, depth, head) = next(order)
+    if affinity is None or head.modelKey() == affinity or head.overtaken >= self.maxOvertakes:
+      return (owner, depth)
+    overtaken = [head]
+    for (candidateOwner, candidateDepth, candidate) in order:
+      if candidate.modelKey() == affinity:
+        for job in overtaken:
+          job.overtaken += 1
+        self.switchesAvoided += 1
+        return (candidateOwner, candidateDepth)
+      if candidate.overtaken >= self.maxOvertakes:
+        break
+      overtaken.append(candidate)
+    return (owner, depth)
+
+  def _positionOf(self, owner: str, depth: int) -> int:
+    # Every owner ahead of this one in the rotation gets up to depth + 1 turns
+    # before this job, every owner behind it up to depth turns.
+    pos = 0
+    ahead = True
+    for (other, jobs) in self._owners.items():
+      if other == owner:
+        ahead = False
+        pos += depth + 1
+        continue
+      pos += min(len(jobs), depth + 1 if ahead else depth)
+    return pos
@@ -1,15 +1,16 @@
 """ Configuration base class and utilities."""
 
 import os
+import copy
 import json
 import logging
 from typing import Any, Dict, Tuple, Union
 
 from .file_utils import (
     CONFIG_NAME,
+    hub_index,
     is_remote_url,
 )
-from huggingface_hub import hf_hub_download
 
 logger = logging.getLogger(__name__)
 
@@ -57,18 +58,25 @@ class PretrainedConfig:
         revision = kwargs.pop("revision", None)
 
         pretrained_model_name_or_path = str(pretrained_model_name_or_path)
+        from_hub = False
         if os.path.isdir(pretrained_model_name_or_path):
             config_file = os.path.join(pretrained_model_name_or_path, CONFIG_NAME)
         elif os.path.isfile(pretrained_model_name_or_path) or is_remote_url(pretrained_model_name_or_path):
             config_file = pretrained_model_name_or_path
         else:
-            config_file = hf_hub_download(
-                pretrained_model_name_or_path, filename=CONFIG_NAME, revision=revision
-            )
+            from_hub = True
+            config_dict = hub_index.get_config(pretrained_model_name_or_path, revision)
+            if config_dict is not None:
+                if scale is not None:
+                    config_dict['scale'] = scale
+                return config_dict, kwargs
+            config_file = hub_index.download(pretrained_model_name_or_path, CONFIG_NAME, revision=revision)
 
         try:
             # Load config dict
             config_dict = cls._dict_from_json_file(config_file)
+            if from_hub:
+                hub_index.put_config(pretrained_model_name_or_path, revision, config_dict)
             if scale is not None:
                 config_dict['scale'] = scale
 
@@ -121,6 +129,17 @@ class PretrainedConfig:
         logger.info(f"Model config {config}")
         return config, kwargs
 
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Serializes this instance to a Python dictionary that ``from_dict`` accepts.
+        Returns:
+            :obj:`Dict[str, Any]`: Dictionary of all the attributes that make up this configuration instance.
+        """
+        output = copy.deepcopy(self.__dict__)
+        output.pop('_name_or_path', None)
+        output['model_type'] = self.__class__.model_type
+        return output
+
     @classmethod
     def _dict_from_json_file(cls, json_file: Union[str, os.PathLike]):
         with open(json_file, "r", encoding="utf-8") as reader:
@@ -0,0 +1,89 @@
+"""
+Converts pickled ``pytorch_model*.pt`` checkpoints into memory-mappable
+safetensors files that ``PreTrainedModel.from_pretrained`` prefers when they
+sit next to the original checkpoint. With ``--export`` it instead writes the
+pre-cast, channels_last files of ``PreTrainedModel.save_pretrained``, which
+``from_pretrained`` prefers when asked for that ``torch_dtype``.
+
+Usage: ``python -m super_image.convert eugenesiow/drln --scale 2 3 4``
+or ``python -m super_image.convert eugenesiow/drln --scale 4 --export fp16``
+"""
+
+import argparse
+import os
+from typing import Optional, Union
+
+import torch
+from huggingface_hub import hf_hub_download
+
+from .file_utils import (
+    WEIGHTS_NAME,
+    WEIGHTS_NAME_SCALE,
+    SAFE_WEIGHTS_NAME,
+    SAFE_WEIGHTS_NAME_SCALE,
+)
+from .safetensors_utils import save_file
+from .configuration_utils import PretrainedConfig
+from .models import get_model_class
+
+
+def convert_checkpoint(archive_file: str, output_file: str) -> str:
+    state_dict = torch.load(archive_file, map_location="cpu")
+    save_file({name: tensor.contiguous() for (name, tensor) in state_dict.items()}, output_file)
+    return output_file
+
+
+def convert_pretrained(pretrained_model_name_or_path: Union[str, os.PathLike], scale: Optional[int] = None) -> str:
+    """
+    Converts the checkpoint of a local model directory or hub repo and writes
+    the result into the same directory as the original checkpoint.
+    """
+    if scale is not None:
+        weights_name = WEIGHTS_NAME_SCALE.format(scale=scale)
+        safe_weights_name = SAFE_WEIGHTS_NAME_SCALE.format(scale=scale)
+    else:
+        weights_name = WEIGHTS_NAME
+        safe_weights_name = SAFE_WEIGHTS_NAME
+
+    pretrained_model_name_or_path = str(pretrained_model_name_or_path)
+    if os.path.isdir(pretrained_model_name_or_path):
+        archive_file = os.path.join(pretrained_model_name_or_path, weights_name)
+    else:
+        archive_file = hf_hub_download(pretrained_model_name_or_path, filename=weights_name)
+    return convert_checkpoint(archive_file, os.path.join(os.path.dirname(archive_file), safe_weights_name))
+
+
+def export_pretrained(pretrained_model_name_or_path: Union[str, os.PathLike], scale: Optional[int] = None,
+                      torch_dtype=torch.float16, model_type: Optional[str] = None) -> str:
+    """
+    Loads a model and writes its ``save_pretrained`` export into the same
+    directory as the original checkpoint.
+    """
+    pretrained_model_name_or_path = str(pretrained_model_name_or_path)
+    if model_type is None:
+        config_dict, _ = PretrainedConfig.get_config_dict(pretrained_model_name_or_path)
+        model_type = config_dict['model_type'].lower().replace('-', '')
+    model = get_model_class(model_type).from_pretrained(pretrained_model_name_or_path, scale=scale)
+    weights_name = WEIGHTS_NAME_SCALE.format(scale=scale) if scale is not None else WEIGHTS_NAME
+    if os.path.isdir(pretrained_model_name_or_path):
+        directory = pretrained_model_name_or_path
+    else:
+        directory = os.path.dirname(hf_hub_download(pretrained_model_name_or_path, filename=weights_name))
+    return model.save_pretrained(directory, torch_dtype=torch_dtype)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert super_image checkpoints to safetensors.')
+    parser.add_argument('models', nargs='+', help='hub repo ids or local model directories')
+    parser.add_argument('--scale', type=int, nargs='*', default=[None])
+    parser.add_argument('--export', choices=['fp16', 'bf16', 'fp32'],
+                        help='write a pre-cast, channels_last export in this dtype instead')
+    parser.add_argument('--model-type', help='model type of the export, read from the config when omitted')
+    args = parser.parse_args()
+    for model in args.models:
+        for scale in args.scale:
+            if args.export is not None:
+                torch_dtype = {'fp16': torch.float16, 'bf16': torch.bfloat16, 'fp32': torch.float32}[args.export]
+                print(export_pretrained(model, scale, torch_dtype, args.model_type))
+            else:
+                print(convert_pretrained(model, scale))
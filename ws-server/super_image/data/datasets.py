@@ -1,10 +1,8 @@
-import h5py
 import numpy as np
 from PIL import Image
 from pathlib import Path
 
 from torch.utils.data import Dataset
-from torchvision.transforms import transforms
 
 
 DIV2K_RGB_MEAN = (0.4488, 0.4371, 0.4040)
@@ -12,6 +10,8 @@ DIV2K_RGB_STD = (1.0, 1.0, 1.0)
 
 
 def augment_five_crop(batch, scale=None):
+    # torchvision and h5py are only needed for datasets, not to run a model
+    from torchvision.transforms import transforms
     hr_augment_path = None
     lr_augment_path = None
     if scale is None:
@@ -96,12 +96,14 @@ class EvalDatasetH5(Dataset):
         self.h5_file = h5_file
 
     def __getitem__(self, idx):
+        import h5py
         with h5py.File(self.h5_file, 'r') as f:
             lr = f['lr'][str(idx)][::].astype(np.float32).transpose([2, 0, 1]) / 255.0
             hr = f['hr'][str(idx)][::].astype(np.float32).transpose([2, 0, 1]) / 255.0
             return lr, hr
 
     def __len__(self):
+        import h5py
         with h5py.File(self.h5_file, 'r') as f:
             return len(f['lr'])
 
@@ -1,5 +1,4 @@
 import numpy as np
-import cv2
 from PIL import Image
 
 import torch
@@ -21,6 +20,7 @@ class ImageLoader:
 
     @staticmethod
     def save_image(pred: Tensor, output_file: str):
+        import cv2
         pred = ImageLoader._process_image_to_save(pred)
         cv2.imwrite(output_file, pred)
 
@@ -4,10 +4,28 @@ Utilities for working with the local cache and the HuggingFace hub.
 Functions are adapted from the HuggingFace transformers library at
 https://github.com/huggingface/transformers/.
 """
+import copy
+import json
+import logging
+import os
+import time
+from threading import Lock
+from typing import Any, Callable, Dict, Optional
 from urllib.parse import urlparse
 
+from huggingface_hub import hf_hub_download
+from huggingface_hub.constants import HUGGINGFACE_HUB_CACHE
+from huggingface_hub.file_download import REGEX_COMMIT_HASH
+
+logger = logging.getLogger(__name__)
+
 WEIGHTS_NAME = 'pytorch_model.pt'
 WEIGHTS_NAME_SCALE = 'pytorch_model_{scale}x.pt'
+SAFE_WEIGHTS_NAME = 'model.safetensors'
+SAFE_WEIGHTS_NAME_SCALE = 'model_{scale}x.safetensors'
+# Pre-cast, channels_last weights with their config, written by PreTrainedModel.save_pretrained
+FAST_WEIGHTS_NAME = 'model.{dtype}.safetensors'
+FAST_WEIGHTS_NAME_SCALE = 'model_{scale}x.{dtype}.safetensors'
 CONFIG_NAME = 'config.json'
 
 
@@ -15,3 +33,89 @@ def is_remote_url(url_or_filename):
     parsed = urlparse(url_or_filename)
     return parsed.scheme in ("http", "https")
 
+
+
+class HubIndex:
+    """
+    Small on-disk index of the files resolved from the hub and of the configs
+    parsed from them, keyed by repo and revision. Lookups of known models are
+    answered from memory, or from the index file after a restart, without
+    asking the hub. Entries are refreshed from the hub after ``ttl`` seconds,
+    except for commit hashes whose files can't change, and stale entries are
+    still used when the hub can't be reached.
+    """
+
+    def __init__(self, path: str, ttl: float, clock: Callable[[], float] = time.time):
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: Optional[Dict[str, Dict[str, Any]]] = None
+        self._lock = Lock()
+
+    @staticmethod
+    def _key(kind: str, repo_id: str, revision: Optional[str], filename: str = '') -> str:
+        return f'{kind}:{repo_id}@{revision or "main"}/{filename}'
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if self._entries is None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as reader:
+                    self._entries = json.load(reader)
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def _get(self, key: str, revision: Optional[str], allow_stale: bool) -> Any:
+        with self._lock:
+            entry = self._load().get(key)
+        if entry is None:
+            return None
+        fresh = REGEX_COMMIT_HASH.match(revision or '') or entry['fetched_at'] + self.ttl >= self.clock()
+        if not fresh and not allow_stale:
+            return None
+        return entry['value']
+
+    def _put(self, key: str, value: Any):
+        with self._lock:
+            entries = self._load()
+            entries[key] = {'value': value, 'fetched_at': self.clock()}
+            try:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                # Write a copy and swap it in, so readers never see a partial index
+                temp_path = f'{self.path}.{os.getpid()}.tmp'
+                with open(temp_path, 'w', encoding='utf-8') as writer:
+                    json.dump(entries, writer)
+                os.replace(temp_path, self.path)
+            except OSError as err:
+                logger.warning(f'Could not write hub index {self.path}: {err}')
+
+    def get_config(self, repo_id: str, revision: Optional[str] = None, allow_stale: bool = False) -> Optional[Dict[str, Any]]:
+        config_dict = self._get(self._key('config', repo_id, revision), revision, allow_stale)
+        # Callers are free to modify the dict they get
+        return copy.deepcopy(config_dict) if config_dict is not None else None
+
+    def put_config(self, repo_id: str, revision: Optional[str], config_dict: Dict[str, Any]):
+        self._put(self._key('config', repo_id, revision), copy.deepcopy(config_dict))
+
+    def download(self, repo_id: str, filename: str, revision: Optional[str] = None) -> str:
+        """Like ``hf_hub_download``, but without asking the hub for files it resolved recently."""
+        key = self._key('file', repo_id, revision, filename)
+        path = self._get(key, revision, allow_stale=False)
+        if path is not None and os.path.isfile(path):
+            return path
+        try:
+            path = hf_hub_download(repo_id, filename=filename, revision=revision)
+        except Exception:
+            path = self._get(key, revision, allow_stale=True)
+            if path is None or not os.path.isfile(path):
+                raise
+            logger.warning(f'Could not reach the hub for {repo_id}, using the cached {filename}')
+            return path
+        self._put(key, path)
+        return path
+
+
+hub_index = HubIndex(
+    os.environ.get('SUPER_IMAGE_HUB_INDEX', os.path.join(HUGGINGFACE_HUB_CACHE, 'super_image_index.json')),
+    float(os.environ.get('SUPER_IMAGE_HUB_INDEX_TTL', 24 * 60 * 60)),
+)
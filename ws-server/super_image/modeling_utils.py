@@ -1,15 +1,16 @@
 """ Modelling base class and utilities."""
 
+import json
 import math
 import os
 import logging
+import threading
+from contextlib import contextmanager
 from typing import Optional, Union, Callable
 
 import torch
 import torch.nn as nn
 
-from huggingface_hub import hf_hub_download
-
 from .configuration_utils import PretrainedConfig
 from .data.datasets import (
     DIV2K_RGB_MEAN,
@@ -18,11 +19,73 @@ from .data.datasets import (
 from .file_utils import (
     WEIGHTS_NAME,
     WEIGHTS_NAME_SCALE,
+    SAFE_WEIGHTS_NAME,
+    SAFE_WEIGHTS_NAME_SCALE,
+    FAST_WEIGHTS_NAME,
+    FAST_WEIGHTS_NAME_SCALE,
+    hub_index,
     is_remote_url,
 )
+from .safetensors_utils import load_file, save_file
 
 logger = logging.getLogger(__name__)
 
+# Initializers that modules call on their freshly allocated parameters.
+_INIT_FUNCTIONS = (
+    'uniform_', 'normal_', 'trunc_normal_', 'constant_', 'ones_', 'zeros_', 'eye_', 'dirac_',
+    'xavier_uniform_', 'xavier_normal_', 'kaiming_uniform_', 'kaiming_normal_', 'orthogonal_', 'sparse_',
+)
+# Dtypes that save_pretrained can export, by their name in the file name
+DTYPE_NAMES = {torch.float16: 'fp16', torch.bfloat16: 'bf16', torch.float32: 'fp32'}
+_init_state = threading.local()
+_init_hooks_lock = threading.Lock()
+_init_hooks_installed = False
+
+
+def _skippable_init(init):
+    def skippable(tensor, *args, **kwargs):
+        skipped = getattr(_init_state, 'skipped', None)
+        if skipped is None:
+            return init(tensor, *args, **kwargs)
+        skipped.append(tensor)
+        return tensor
+    skippable.__name__ = init.__name__
+    skippable.__doc__ = init.__doc__
+    return skippable
+
+
+def _install_init_hooks():
+    global _init_hooks_installed
+    with _init_hooks_lock:
+        if _init_hooks_installed:
+            return
+        for name in _INIT_FUNCTIONS:
+            if hasattr(nn.init, name):
+                setattr(nn.init, name, _skippable_init(getattr(nn.init, name)))
+        _init_hooks_installed = True
+
+
+@contextmanager
+def no_init_weights():
+    """
+    Turns the ``torch.nn.init`` initializers into no-ops for modules constructed
+    in this thread, for models whose weights are about to be overwritten by a
+    checkpoint anyway. Yields the list of tensors that were left uninitialized.
+    Other threads keep initializing normally.
+    """
+    _install_init_hooks()
+    skipped = []
+    _init_state.skipped = skipped
+    try:
+        yield skipped
+    finally:
+        _init_state.skipped = None
+
+
+def is_init_skipped() -> bool:
+    """Whether models constructed right now skip their weight initialization."""
+    return getattr(_init_state, 'skipped', None) is not None
+
 
 def make_layer(block, n_layers):
     layers = []
@@ -158,6 +221,18 @@ class BamBlock(nn.Module):
 
 
 class PreTrainedModel(nn.Module):
+    # Checkpoint tensors whose name contains one of these may not fit the model,
+    # e.g. upsamplers trained for another scale, and are left as constructed
+    _tolerant_keys = ('tail',)
+    # Checkpoint tensors that are never loaded because the model computes them
+    _ignored_keys = ()
+    # Default strictness of load_state_dict about unexpected checkpoint tensors
+    _strict_load = True
+    # Whether a strict load_state_dict also requires every model tensor in the checkpoint
+    _require_all_keys = False
+    # Whether from_pretrained may skip the random initialization of the weights
+    _skip_init = True
+
     def __init__(self, config: PretrainedConfig, *inputs, **kwargs):
         super().__init__()
         if not isinstance(config, PretrainedConfig):
@@ -170,15 +245,175 @@ class PreTrainedModel(nn.Module):
         self.config = config
         self.name_or_path = config.name_or_path
 
+    def load_state_dict(self, state_dict, strict=None):
+        """
+        Loads the tensors of a checkpoint into the model. Checkpoint tensors are
+        checked against the model first and then assigned in one pass, taking
+        over their storage where dtype and device already match, so tensors of
+        a memory-mapped checkpoint are not copied.
+        Returns:
+            :obj:`set`: The names of the model tensors that were loaded.
+        """
+        if strict is None:
+            strict = self._strict_load
+        own_state = self.state_dict(keep_vars=True)
+        assignments = []
+        loaded = set()
+        for name, param in state_dict.items():
+            if name in self._ignored_keys:
+                continue
+            if name in own_state:
+                if isinstance(param, nn.Parameter):
+                    param = param.data
+                own = own_state[name]
+                if own.size() == param.size():
+                    assignments.append((own, param))
+                    loaded.add(name)
+                    continue
+                try:
+                    # Broadcastable tensors have always been accepted
+                    with torch.no_grad():
+                        own.copy_(param)
+                    loaded.add(name)
+                except Exception:
+                    if any(name.find(key) >= 0 for key in self._tolerant_keys):
+                        logger.info(f'Replace pre-trained upsampler to new one for {name}')
+                    else:
+                        raise RuntimeError(f'While copying the parameter named {name}, '
+                                           f'whose dimensions in the model are {own.size()} and '
+                                           f'whose dimensions in the checkpoint are {param.size()}.')
+            elif strict:
+                if name.find('tail') == -1:
+                    raise KeyError(f'unexpected key "{name}" in state_dict')
+
+        if strict and self._require_all_keys:
+            missing = set(own_state.keys()) - set(state_dict.keys())
+            if len(missing) > 0:
+                raise KeyError(f'missing keys in state_dict: "{missing}"')
+
+        with torch.no_grad():
+            for own, param in assignments:
+                dense = param.is_contiguous() or (
+                    param.dim() == 4 and param.is_contiguous(memory_format=torch.channels_last))
+                if own.dtype == param.dtype and own.device == param.device and dense:
+                    own.data = param
+                else:
+                    own.copy_(param)
+        return loaded
+
+    @classmethod
+    def _construct(cls, config, state_dict, *model_args, torch_dtype=None, **model_kwargs):
+        if config.data_parallel or not cls._skip_init:
+            model = cls(config, *model_args, **model_kwargs)
+            if torch_dtype is not None:
+                model.to(torch_dtype)
+            if config.data_parallel and not isinstance(model, nn.DataParallel):
+                model = nn.DataParallel(model)
+            model.load_state_dict(state_dict)
+            return model
+
+        with no_init_weights() as skipped:
+            model = cls(config, *model_args, **model_kwargs)
+        # Tensors that were replaced after their initializer ran have nothing to fear
+        names = {
+            tensor.data_ptr(): name
+            for name, tensor in model.state_dict(keep_vars=True).items()
+            if tensor.numel() > 0
+        }
+        uninitialized = {names[tensor.data_ptr()] for tensor in skipped if tensor.data_ptr() in names}
+        if torch_dtype is not None:
+            # Only casts empty tensors, checkpoints in torch_dtype are then taken over as they are
+            model.to(torch_dtype)
+        loaded = model.load_state_dict(state_dict)
+        if uninitialized <= loaded:
+            return model
+
+        # The checkpoint doesn't cover everything that was left uninitialized
+        logger.info(f'{cls.__name__} needs its initializers for {uninitialized - loaded}')
+        model = cls(config, *model_args, **model_kwargs)
+        if torch_dtype is not None:
+            model.to(torch_dtype)
+        model.load_state_dict(state_dict)
+        return model
+
+    def save_pretrained(self, save_directory: Union[str, os.PathLike], torch_dtype=torch.float16,
+                        channels_last: bool = True) -> str:
+        """
+        Exports the weights cast to ``torch_dtype``, 4D tensors laid out channels
+        last, together with the config into a single safetensors file.
+        ``from_pretrained`` prefers that file when it is asked for the same
+        ``torch_dtype``, and maps it without any conversion.
+        Returns:
+            :obj:`str`: The path of the written file.
+        """
+        if torch_dtype not in DTYPE_NAMES:
+            raise ValueError(f'Unsupported dtype {torch_dtype}, should be one of {list(DTYPE_NAMES)}')
+        scale = self.config.scale
+        if scale is not None:
+            weights_name = FAST_WEIGHTS_NAME_SCALE.format(scale=scale, dtype=DTYPE_NAMES[torch_dtype])
+        else:
+            weights_name = FAST_WEIGHTS_NAME.format(dtype=DTYPE_NAMES[torch_dtype])
+        state_dict = {}
+        for name, tensor in self.state_dict().items():
+            if tensor.is_floating_point():
+                tensor = tensor.to(torch_dtype)
+            if channels_last and tensor.dim() == 4:
+                # Stored in NHWC order, viewed back as NCHW with channels_last strides on load
+                tensor = tensor.permute(0, 2, 3, 1)
+            state_dict[name] = tensor.contiguous()
+        metadata = {
+            'config': json.dumps(self.config.to_dict()),
+            'memory_format': 'channels_last' if channels_last else 'contiguous',
+        }
+        os.makedirs(save_directory, exist_ok=True)
+        output_file = os.path.join(save_directory, weights_name)
+        save_file(state_dict, output_file, metadata)
+        return output_file
+
+    @classmethod
+    def _find_fast_weights(cls, pretrained_model_name_or_path: str, scale: Optional[int], torch_dtype) -> Optional[str]:
+        if scale is not None:
+            weights_name = WEIGHTS_NAME_SCALE.format(scale=scale)
+            fast_weights_name = FAST_WEIGHTS_NAME_SCALE.format(scale=scale, dtype=DTYPE_NAMES[torch_dtype])
+        else:
+            weights_name = WEIGHTS_NAME
+            fast_weights_name = FAST_WEIGHTS_NAME.format(dtype=DTYPE_NAMES[torch_dtype])
+        if os.path.isdir(pretrained_model_name_or_path):
+            directory = pretrained_model_name_or_path
+        elif os.path.isfile(pretrained_model_name_or_path) or is_remote_url(pretrained_model_name_or_path):
+            return None
+        else:
+            # Exported files sit next to the downloaded checkpoint
+            directory = os.path.dirname(hub_index.download(pretrained_model_name_or_path, weights_name))
+        fast_file = os.path.join(directory, fast_weights_name)
+        return fast_file if os.path.isfile(fast_file) else None
+
     @classmethod
     def from_pretrained(cls, pretrained_model_name_or_path: Optional[Union[str, os.PathLike]], *model_args, **kwargs):
         scale = kwargs.get("scale", None)
         config = kwargs.pop("config", None)
         state_dict = kwargs.pop("state_dict", None)
         cache_dir = kwargs.pop("cache_dir", None)
+        torch_dtype = kwargs.pop("torch_dtype", None)
+
+        # Prefer weights exported by save_pretrained in the requested dtype
+        fast_file = None
+        metadata = {}
+        if state_dict is None and torch_dtype in DTYPE_NAMES and pretrained_model_name_or_path is not None:
+            fast_file = cls._find_fast_weights(str(pretrained_model_name_or_path), scale, torch_dtype)
+        if fast_file is not None:
+            logger.info(f"loading exported weights file {fast_file}")
+            state_dict, metadata = load_file(fast_file)
+            if metadata.get('memory_format') == 'channels_last':
+                state_dict = {
+                    name: tensor.permute(0, 3, 1, 2) if tensor.dim() == 4 else tensor
+                    for name, tensor in state_dict.items()
+                }
 
         # Load config if we don't provide a configuration
-        if not isinstance(config, PretrainedConfig):
+        if not isinstance(config, PretrainedConfig) and 'config' in metadata:
+            config, model_kwargs = cls.config_class.from_dict(json.loads(metadata['config']), **kwargs)
+        elif not isinstance(config, PretrainedConfig):
             config_path = config if config is not None else pretrained_model_name_or_path
             config, model_kwargs = cls.config_class.from_pretrained(
                 config_path,
@@ -192,14 +427,21 @@ class PreTrainedModel(nn.Module):
         # Setup scale
         if scale is not None:
             weights_name = WEIGHTS_NAME_SCALE.format(scale=scale)
+            safe_weights_name = SAFE_WEIGHTS_NAME_SCALE.format(scale=scale)
         else:
             weights_name = WEIGHTS_NAME
+            safe_weights_name = SAFE_WEIGHTS_NAME
 
         # Load model
-        if pretrained_model_name_or_path is not None:
+        if fast_file is not None:
+            archive_file = fast_file
+        elif pretrained_model_name_or_path is not None:
             pretrained_model_name_or_path = str(pretrained_model_name_or_path)
             if os.path.isdir(pretrained_model_name_or_path):
-                if os.path.isfile(os.path.join(pretrained_model_name_or_path, weights_name)):
+                if os.path.isfile(os.path.join(pretrained_model_name_or_path, safe_weights_name)):
+                    # Load from a memory-mapped checkpoint
+                    archive_file = os.path.join(pretrained_model_name_or_path, safe_weights_name)
+                elif os.path.isfile(os.path.join(pretrained_model_name_or_path, weights_name)):
                     # Load from a PyTorch checkpoint
                     archive_file = os.path.join(pretrained_model_name_or_path, weights_name)
                 else:
@@ -213,18 +455,22 @@ class PreTrainedModel(nn.Module):
                 # set correct filename
                 filename = weights_name
 
-                archive_file = hf_hub_download(
-                    pretrained_model_name_or_path,
-                    filename=filename
-                )
-            
+                archive_file = hub_index.download(pretrained_model_name_or_path, filename)
+                # Prefer a checkpoint converted by `super_image.convert` next to the downloaded one
+                converted_file = os.path.join(os.path.dirname(archive_file), safe_weights_name)
+                if os.path.isfile(converted_file):
+                    archive_file = converted_file
+
             logger.info(f"loading weights file {archive_file}")
         else:
            archive_file = None
 
         if state_dict is None:
             try:
-                state_dict = torch.load(archive_file, map_location="cpu")
+                if archive_file.endswith('.safetensors'):
+                    state_dict, _ = load_file(archive_file)
+                else:
+                    state_dict = torch.load(archive_file, map_location="cpu")
             except Exception:
                 raise OSError(
                     f"Unable to load weights from pytorch checkpoint file for '{pretrained_model_name_or_path}' "
@@ -233,10 +479,7 @@ class PreTrainedModel(nn.Module):
 
         config.name_or_path = pretrained_model_name_or_path
 
-        model = cls(config, *model_args, **model_kwargs)
-        if config.data_parallel and not isinstance(model, nn.DataParallel):
-            model = nn.DataParallel(model)
-        model.load_state_dict(state_dict)
+        model = cls._construct(config, state_dict, *model_args, torch_dtype=torch_dtype, **model_kwargs)
 
         # Set model in evaluation mode to deactivate DropOut modules by default
         model.eval()
@@ -1,36 +1,65 @@
-from .edsr.modeling_edsr import EdsrModel
-from .edsr.configuration_edsr import EdsrConfig
-from .msrn.modeling_msrn import MsrnModel
-from .msrn.configuration_msrn import MsrnConfig
-from .a2n.configuration_a2n import A2nConfig
-from .a2n.modeling_a2n import A2nModel
-from .pan.configuration_pan import PanConfig
-from .pan.modeling_pan import PanModel
-from .masa.configuration_masa import MasaConfig
-from .masa.modeling_masa import MasaModel
-from .carn.configuration_carn import CarnConfig
-from .carn.modeling_carn import CarnModel
-from .jiif.configuration_jiif import JiifConfig
-from .jiif.modeling_jiif import JiifModel
-from .liif.configuration_liif import LiifConfig
-from .liif.modeling_liif import LiifModel
-from .smsr.configuration_smsr import SmsrConfig
-from .smsr.modeling_smsr import SmsrModel
-from .drln.modeling_drln import DrlnModel
-from .drln.configuration_drln import DrlnConfig
-from .rcan.modeling_rcan import RcanModel
-from .rcan.configuration_rcan import RcanConfig
-from .mdsr.modeling_mdsr import MdsrModel
-from .mdsr.configuration_mdsr import MdsrConfig
-from .drn.configuration_drn import DrnConfig
-from .drn.modeling_drn import DrnModel
-from .physicssr.configuration_physicssr import PhysicssrConfig
-from .physicssr.modeling_physicssr import PhysicssrModel
-from .han.configuration_han import HanConfig
-from .han.modeling_han import HanModel
-from .awsrn.configuration_awsrn import AwsrnConfig
-from .awsrn.modeling_awsrn import AwsrnModel
-from .rnan.configuration_rnan import RnanConfig
-from .rnan.modeling_rnan import RnanModel
-from .ddbpn.configuration_ddbpn import DdbpnConfig
-from .ddbpn.modeling_ddbpn import DdbpnModel
+"""
+Registry of the model zoo. Architectures are only imported when one of their
+classes is first accessed, e.g. ``from super_image.models import EdsrModel``
+or ``get_model_class('edsr')``, so importing the package stays cheap.
+"""
+
+import importlib
+
+# Model type name -> (model class, config class), living in
+# ``.{type}.modeling_{type}`` and ``.{type}.configuration_{type}``
+MODEL_TYPES = {
+    'edsr': ('EdsrModel', 'EdsrConfig'),
+    'msrn': ('MsrnModel', 'MsrnConfig'),
+    'a2n': ('A2nModel', 'A2nConfig'),
+    'pan': ('PanModel', 'PanConfig'),
+    'masa': ('MasaModel', 'MasaConfig'),
+    'carn': ('CarnModel', 'CarnConfig'),
+    'jiif': ('JiifModel', 'JiifConfig'),
+    'liif': ('LiifModel', 'LiifConfig'),
+    'smsr': ('SmsrModel', 'SmsrConfig'),
+    'drln': ('DrlnModel', 'DrlnConfig'),
+    'rcan': ('RcanModel', 'RcanConfig'),
+    'mdsr': ('MdsrModel', 'MdsrConfig'),
+    'drn': ('DrnModel', 'DrnConfig'),
+    'physicssr': ('PhysicssrModel', 'PhysicssrConfig'),
+    'han': ('HanModel', 'HanConfig'),
+    'awsrn': ('AwsrnModel', 'AwsrnConfig'),
+    'rnan': ('RnanModel', 'RnanConfig'),
+    'ddbpn': ('DdbpnModel', 'DdbpnConfig'),
+}
+
+_MODULES = {}
+for _model_type, (_model_name, _config_name) in MODEL_TYPES.items():
+    _MODULES[_model_name] = f'.{_model_type}.modeling_{_model_type}'
+    _MODULES[_config_name] = f'.{_model_type}.configuration_{_model_type}'
+
+__all__ = ['MODEL_TYPES', 'get_model_class', 'get_config_class', *_MODULES]
+
+
+def __getattr__(name):
+    module = _MODULES.get(name)
+    if module is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(module, __name__), name)
+    # Cache it on the package, so later lookups don't come through here again
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_MODULES))
+
+
+def get_model_class(model_type: str):
+    """Returns the model class of a model type such as ``'edsr'``, importing its architecture."""
+    if model_type not in MODEL_TYPES:
+        raise ValueError(f'Unknown model type {model_type}, should be one of {", ".join(MODEL_TYPES)}')
+    return __getattr__(MODEL_TYPES[model_type][0])
+
+
+def get_config_class(model_type: str):
+    """Returns the config class of a model type such as ``'edsr'``."""
+    if model_type not in MODEL_TYPES:
+        raise ValueError(f'Unknown model type {model_type}, should be one of {", ".join(MODEL_TYPES)}')
+    return __getattr__(MODEL_TYPES[model_type][1])
@@ -86,6 +86,8 @@ class LFB(nn.Module):
 
 class AwsrnModel(PreTrainedModel):
     config_class = AwsrnConfig
+    _tolerant_keys = ('tail', 'skip')
+    _require_all_keys = True
 
     def __init__(self, args):
         super(AwsrnModel, self).__init__(args)
@@ -148,29 +150,3 @@ class AwsrnModel(PreTrainedModel):
         if not self.bam:
             x = x * 127.5 + self.rgb_mean.to(self.device) * 255
         return x
-
-    def load_state_dict(self, state_dict, strict=True):
-        own_state = self.state_dict()
-        for name, param in state_dict.items():
-            if name in own_state:
-                if isinstance(param, nn.Parameter):
-                    param = param.data
-                try:
-                    own_state[name].copy_(param)
-                except Exception:
-                    if name.find('tail') >= 0 or  name.find('skip') >= 0:
-                        print('Replace pre-trained upsampler to new one...')
-                    else:
-                        raise RuntimeError('While copying the parameter named {}, '
-                                           'whose dimensions in the model are {} and '
-                                           'whose dimensions in the checkpoint are {}.'
-                                           .format(name, own_state[name].size(), param.size()))
-            elif strict:
-                if name.find('tail') == -1:
-                    raise KeyError('unexpected key "{}" in state_dict'
-                                   .format(name))
-
-        if strict:
-            missing = set(own_state.keys()) - set(state_dict.keys())
-            if len(missing) > 0:
-                raise KeyError('missing keys in state_dict: "{}"'.format(missing))
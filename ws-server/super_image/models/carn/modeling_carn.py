@@ -180,20 +180,3 @@ class CarnModel(PreTrainedModel):
         out = self.add_mean(out)
 
         return out
-
-    def load_state_dict(self, state_dict, strict=True):
-        own_state = self.state_dict()
-        for name, param in state_dict.items():
-            if name in own_state:
-                if isinstance(param, nn.Parameter):
-                    param = param.data
-                try:
-                    own_state[name].copy_(param)
-                except Exception:
-                    if name.find('tail') == -1:
-                        raise RuntimeError(f'While copying the parameter named {name}, '
-                                           f'whose dimensions in the model are {own_state[name].size()} and '
-                                           f'whose dimensions in the checkpoint are {param.size()}.')
-            elif strict:
-                if name.find('tail') == -1:
-                    raise KeyError(f'unexpected key "{name}" in state_dict')
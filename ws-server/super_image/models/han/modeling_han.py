@@ -144,6 +144,8 @@ class ResidualGroup(nn.Module):
 
 class HanModel(PreTrainedModel):
     config_class = HanConfig
+    _strict_load = False
+    _require_all_keys = True
 
     def __init__(self, args, conv=default_conv):
         super(HanModel, self).__init__(args)
@@ -217,29 +219,3 @@ class HanModel(PreTrainedModel):
         x = self.add_mean(x)
 
         return x
-
-    def load_state_dict(self, state_dict, strict=False):
-        own_state = self.state_dict()
-        for name, param in state_dict.items():
-            if name in own_state:
-                if isinstance(param, nn.Parameter):
-                    param = param.data
-                try:
-                    own_state[name].copy_(param)
-                except Exception:
-                    if name.find('tail') >= 0:
-                        print('Replace pre-trained upsampler to new one...')
-                    else:
-                        raise RuntimeError('While copying the parameter named {}, '
-                                           'whose dimensions in the model are {} and '
-                                           'whose dimensions in the checkpoint are {}.'
-                                           .format(name, own_state[name].size(), param.size()))
-            elif strict:
-                if name.find('tail') == -1:
-                    raise KeyError('unexpected key "{}" in state_dict'
-                                   .format(name))
-
-        if strict:
-            missing = set(own_state.keys()) - set(state_dict.keys())
-            if len(missing) > 0:
-                raise KeyError('missing keys in state_dict: "{}"'.format(missing))
@@ -8,6 +8,7 @@ import torch.nn.functional as functional
 
 from .configuration_masa import MasaConfig
 from ...modeling_utils import (
+    is_init_skipped,
     make_layer,
     PreTrainedModel
 )
@@ -215,6 +216,9 @@ class MasaModel(PreTrainedModel):
         self.weight_init(scale=0.1)
 
     def weight_init(self, scale=0.1):
+        if is_init_skipped():
+            # Overwritten by the checkpoint that is about to be loaded
+            return
         for name, m in self.named_modules():
             classname = m.__class__.__name__
             if classname == 'DCN':
@@ -68,6 +68,7 @@ class MsrBamBlock(nn.Module):
 
 class MsrnModel(PreTrainedModel):
     config_class = MsrnConfig
+    _require_all_keys = True
 
     def __init__(self, args, conv=default_conv):
         super(MsrnModel, self).__init__(args)
@@ -120,27 +121,3 @@ class MsrnModel(PreTrainedModel):
         x = self.tail(res)
         # x = self.add_mean(x)
         return x
-
-    def load_state_dict(self, state_dict, strict=True):
-        own_state = self.state_dict()
-        for name, param in state_dict.items():
-            if name in own_state:
-                if isinstance(param, nn.Parameter):
-                    param = param.data
-                try:
-                    own_state[name].copy_(param)
-                except Exception:
-                    if name.find('tail') >= 0:
-                        print('Replace pre-trained upsampler to new one...')
-                    else:
-                        raise RuntimeError(f'While copying the parameter named {name}, '
-                                           f'whose dimensions in the model are {own_state[name].size()} and '
-                                           f'whose dimensions in the checkpoint are {param.size()}.')
-            elif strict:
-                if name.find('tail') == -1:
-                    raise KeyError(f'unexpected key "{name}" in state_dict')
-
-        if strict:
-            missing = set(own_state.keys()) - set(state_dict.keys())
-            if len(missing) > 0:
-                raise KeyError(f'missing keys in state_dict: "{missing}"')
@@ -37,6 +37,9 @@ class ResBlock(nn.Module):
 
 class PhysicssrModel(PreTrainedModel):
     config_class = PhysicssrConfig
+    # The blur kernel is computed in __init__, not loaded
+    _ignored_keys = ('gaussian_blur.weight',)
+    _skip_init = False
 
     def __init__(self, args, conv=default_conv):
         super(PhysicssrModel, self).__init__(args)
@@ -169,24 +172,3 @@ class PhysicssrModel(PreTrainedModel):
         x_refine2 = self.add_mean(x_refine2)
 
         return x_coarsest, x_refine1, x_refine2
-
-    def load_state_dict(self, state_dict, strict=True):
-        own_state = self.state_dict()
-        for name, param in state_dict.items():
-            if name == 'gaussian_blur.weight':
-                continue
-            if name in own_state:
-                if isinstance(param, nn.Parameter):
-                    param = param.data
-                try:
-                    own_state[name].copy_(param)
-                except Exception:
-                    if name.find('tail') == -1:
-                        raise RuntimeError('While copying the parameter named {}, '
-                                           'whose dimensions in the model are {} and '
-                                           'whose dimensions in the checkpoint are {}.'
-                                           .format(name, own_state[name].size(), param.size()))
-            elif strict:
-                if name.find('tail') == -1:
-                    raise KeyError('unexpected key "{}" in state_dict'
-                                   .format(name))
@@ -290,6 +290,8 @@ class _NLResGroup(nn.Module):
 
 class RnanModel(PreTrainedModel):
     config_class = RnanConfig
+    _strict_load = False
+    _require_all_keys = True
 
     def __init__(self, args, conv=default_conv):
         super(RnanModel, self).__init__(args)
@@ -353,29 +355,3 @@ class RnanModel(PreTrainedModel):
             # which consumes a huge amount of memory on the eval SR image
             # https://github.com/yulunzhang/RNAN/issues/12
             print('eval')
-
-    def load_state_dict(self, state_dict, strict=False):
-        own_state = self.state_dict()
-        for name, param in state_dict.items():
-            if name in own_state:
-                if isinstance(param, nn.Parameter):
-                    param = param.data
-                try:
-                    own_state[name].copy_(param)
-                except Exception:
-                    if name.find('tail') >= 0:
-                        print('Replace pre-trained upsampler to new one...')
-                    else:
-                        raise RuntimeError('While copying the parameter named {}, '
-                                           'whose dimensions in the model are {} and '
-                                           'whose dimensions in the checkpoint are {}.'
-                                           .format(name, own_state[name].size(), param.size()))
-            elif strict:
-                if name.find('tail') == -1:
-                    raise KeyError('unexpected key "{}" in state_dict'
-                                   .format(name))
-
-        if strict:
-            missing = set(own_state.keys()) - set(state_dict.keys())
-            if len(missing) > 0:
-                raise KeyError('missing keys in state_dict: "{}"'.format(missing))
@@ -0,0 +1,86 @@
+"""
+Reading and writing of checkpoints in the safetensors layout: an 8 byte little
+endian header length, a JSON header describing every tensor, then the raw
+tensor bytes. Tensors are read as memory-mapped, copy-on-write views of the
+file, so loading only maps pages in as they are touched and doesn't need the
+``safetensors`` package.
+"""
+
+import json
+import struct
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import torch
+
+_DTYPES = {
+    'F64': (torch.float64, np.float64),
+    'F32': (torch.float32, np.float32),
+    'F16': (torch.float16, np.float16),
+    # numpy has no bfloat16, its bytes are mapped as int16 and reinterpreted
+    'BF16': (torch.bfloat16, np.int16),
+    'I64': (torch.int64, np.int64),
+    'I32': (torch.int32, np.int32),
+    'I16': (torch.int16, np.int16),
+    'I8': (torch.int8, np.int8),
+    'U8': (torch.uint8, np.uint8),
+    'BOOL': (torch.bool, np.bool_),
+}
+_DTYPE_NAMES = {torch_dtype: name for (name, (torch_dtype, _)) in _DTYPES.items()}
+
+
+def load_file(path: str) -> Tuple[Dict[str, torch.Tensor], Dict[str, str]]:
+    """
+    Maps the tensors of a safetensors file without copying them.
+    Returns:
+        :obj:`Tuple[Dict, Dict]`: The state dict and the metadata stored in the header.
+    """
+    with open(path, 'rb') as reader:
+        (header_size,) = struct.unpack('<Q', reader.read(8))
+        header = json.loads(reader.read(header_size))
+    metadata = header.pop('__metadata__', None) or {}
+    if len(header) == 0:
+        return {}, metadata
+    data = np.memmap(path, dtype=np.uint8, mode='c', offset=8 + header_size)
+    state_dict = {}
+    for (name, info) in header.items():
+        (torch_dtype, np_dtype) = _DTYPES[info['dtype']]
+        (start, end) = info['data_offsets']
+        array = data[start:end].view(np_dtype).reshape(info['shape'])
+        tensor = torch.from_numpy(array)
+        if tensor.dtype != torch_dtype:
+            tensor = tensor.view(torch_dtype)
+        state_dict[name] = tensor
+    return state_dict, metadata
+
+
+def save_file(state_dict: Dict[str, torch.Tensor], path: str, metadata: Optional[Dict[str, str]] = None):
+    header = {}
+    offset = 0
+    buffers = []
+    for (name, tensor) in state_dict.items():
+        tensor = tensor.detach().cpu()
+        if tensor.dtype not in _DTYPE_NAMES:
+            raise ValueError(f'Unsupported dtype {tensor.dtype} for tensor {name}')
+        raw = tensor.contiguous()
+        if raw.dtype == torch.bfloat16:
+            # numpy has no bfloat16, write its bytes through a same-sized integer view
+            raw = raw.view(torch.int16)
+        buffer = raw.numpy().tobytes()
+        header[name] = {
+            'dtype': _DTYPE_NAMES[tensor.dtype],
+            'shape': list(tensor.shape),
+            'data_offsets': [offset, offset + len(buffer)],
+        }
+        offset += len(buffer)
+        buffers.append(buffer)
+    if metadata:
+        header['__metadata__'] = metadata
+    encoded = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    # Pad the header so the tensor data starts 8 byte aligned
+    encoded += b' ' * (-len(encoded) % 8)
+    with open(path, 'wb') as writer:
+        writer.write(struct.pack('<Q', len(encoded)))
+        writer.write(encoded)
+        for buffer in buffers:
+            writer.write(buffer)
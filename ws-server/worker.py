@@ -1,60 +1,378 @@
+import time
 import traceback
+import multiprocessing
 from flask import Flask
 from flask_socketio import SocketIO
-from typing import Any, Literal, Union
-from collections import deque
-from queue import Queue
+from typing import Any, Literal, Optional, Union
 
 from job import JobDefinition, make_job, BaseJob
+from scheduler import FairShareQueue
+from journal import JobJournal
+from admission import AdmissionController
+from estimator import RuntimeEstimator
+from prefetcher import Prefetcher
+from laneProcess import cacheStats, configureDevice, runLaneProcess
+
+class LaneConfig:
+    def __init__(self, device: str = 'cpu', threads: Optional[int] = None):
+      self.device = device
+      self.threads = threads
+
+    @staticmethod
+    def parse(spec: Union[str, 'list[Union[str, LaneConfig]]', None]) -> 'list[LaneConfig]':
+      """
+      Parses a lane specification such as ``"cuda:0,cuda:1"`` or ``"cpu:4,cpu:4"``.
+      For cuda lanes the suffix is the device index, for cpu lanes it is the
+      number of torch threads the lane may use.
+      """
+      if spec is None or spec == '':
+        return LaneConfig.detect()
+      if isinstance(spec, str):
+        spec = [s.strip() for s in spec.split(',') if s.strip() != '']
+      lanes: 'list[LaneConfig]' = []
+      for entry in spec:
+        if isinstance(entry, LaneConfig):
+          lanes.append(entry)
+          continue
+        (kind, _, arg) = entry.partition(':')
+        if kind == 'cuda':
+          lanes.append(LaneConfig(f'cuda:{int(arg or 0)}'))
+        elif kind == 'cpu':
+          lanes.append(LaneConfig('cpu', int(arg) if arg else None))
+        else:
+          raise ValueError(f'Invalid lane specification: {entry}')
+      return lanes
+
+    @staticmethod
+    def detect() -> 'list[LaneConfig]':
+      from torch import cuda
+      if cuda.is_available():
+        return [LaneConfig(f'cuda:{i}') for i in range(cuda.device_count())]
+      return [LaneConfig('cpu')]
+
+class Lane:
+    def __init__(self, worker: 'Worker', index: int, config: LaneConfig):
+      self.worker = worker
+      self.index = index
+      self.device = config.device
+      self.threads = config.threads
+      self.currentJob: Optional[BaseJob] = None
+      self.lastModelKey = None
+      self.busyUntil = 0.0
+      self.thread = None
+
+    def start(self, app: Flask):
+      self.thread = self.worker.socketio.start_background_task(target=self, app=app)
+
+    def setupDevice(self):
+      configureDevice(self.device, self.threads)
+
+    def execute(self, jobs: 'list[BaseJob]'):
+      if len(jobs) == 1:
+        jobs[0].run()
+      else:
+        type(jobs[0]).runBatch(jobs)
+
+    def __call__(self, app: Flask):
+      with app.app_context():
+        self.setupDevice()
+        while True:
+          job: Union[BaseJob, Literal['stop']] = self.worker.queue.get(self.lastModelKey)
+          if job == 'stop' or self.worker.stopping:
+            self.worker.queue.task_done()
+            break
+          if not self.worker.isRunnable(job):
+            self.worker.finishJob(job)
+            continue
+          jobs = [job] + self.collectBatch(job)
+          self.worker.updateQueue()
+          for batched in jobs:
+            batched.device = self.device
+            if self.worker.journal is not None:
+              self.worker.journal.started(batched)
+          self.lastModelKey = job.modelKey()
+          self.currentJob = job
+          startedAt = time.time()
+          self.busyUntil = startedAt + sum(batched.estimate for batched in jobs)
+          try:
+            self.execute(jobs)
+          except Exception:
+            traceback.print_exc()
+          elapsed = time.time() - startedAt
+          totalCost = sum(batched.cost() for batched in jobs)
+          for batched in jobs:
+            # Failed and cancelled runs say nothing about how long a job takes
+            if batched.status == 'success':
+              share = batched.cost() / totalCost if totalCost > 0 else 1 / len(jobs)
+              self.worker.estimator.record(batched, elapsed * share)
+          self.currentJob = None
+          for batched in jobs:
+            self.worker.finishJob(batched)
+      self.shutdown()
+
+    def shutdown(self):
+      pass
+
+    def cacheStats(self) -> Optional[dict]:
+      return cacheStats()
+
+    def collectBatch(self, job: BaseJob) -> 'list[BaseJob]':
+      batchKey = job.batchKey()
+      maxSize = self.worker.app.config.get('BATCH_MAX_SIZE', 1)
+      if batchKey is None or job.batchSize() >= maxSize:
+        return []
+      batch: 'list[BaseJob]' = []
+      for candidate in self.worker.queue.takeCompatible(
+        batchKey,
+        maxSize - job.batchSize(),
+        self.worker.app.config.get('BATCH_WINDOW', 0),
+      ):
+        if self.worker.isRunnable(candidate):
+          batch.append(candidate)
+        else:
+          self.worker.finishJob(candidate)
+      return batch
+
+class ProcessLane(Lane):
+    """
+    Lane that runs its jobs in a spawned process, so inference never holds the
+    GIL or the eventlet hub of the Socket.IO server. Everything the jobs emit
+    comes back over a pipe and is re-emitted from the server process.
+    """
+
+    POLL_INTERVAL = 0.01
+
+    def start(self, app: Flask):
+      # Reported by the process after every batch
+      self.lastCacheStats: Optional[dict] = None
+      self.spawn()
+      super().start(app)
+
+    def spawn(self):
+      context = multiprocessing.get_context('spawn')
+      (self.conn, childConn) = context.Pipe()
+      self.process = context.Process(
+        target=runLaneProcess,
+        args=(childConn, self.device, self.threads),
+        daemon=True,
+      )
+      self.process.start()
+      # Only the child may hold its end, so its death shows up as EOF here
+      childConn.close()
+
+    def respawn(self):
+      if self.process.is_alive():
+        self.process.kill()
+      self.process.join()
+      self.conn.close()
+      self.spawn()
+
+    def setupDevice(self):
+      pass
+
+    def execute(self, jobs: 'list[BaseJob]'):
+      try:
+        self.relay(jobs)
+      except (EOFError, OSError):
+        # The process died mid-batch (a crash or the OOM killer), so whatever
+        # it didn't complete never will be.
+        traceback.print_exc()
+        for job in jobs:
+          if job.status is None:
+            job.complete('error', error = 'The worker running the job exited unexpectedly')
+        self.respawn()
+
+    def relay(self, jobs: 'list[BaseJob]'):
+      byId = {job.id: job for job in jobs}
+      self.conn.send(('run', [(job.sid, job.id, job.definition) for job in jobs]))
+      cancelSent: 'set[str]' = set()
+      while True:
+        for job in jobs:
+          if job.cancelled and job.id not in cancelSent:
+            cancelSent.add(job.id)
+            self.conn.send(('cancel', job.id))
+        # Poll instead of blocking in recv, which would stall the server's hub.
+        if not self.conn.poll():
+          self.worker.socketio.sleep(self.POLL_INTERVAL)
+          continue
+        message = self.conn.recv()
+        if message[0] == 'done':
+          self.lastCacheStats = message[1]
+          return
+        if message[0] == 'emit':
+          (_, event, args, to) = message
+          if event == 'job_complete':
+            # The jobs completed in the lane process, their copies here only
+            # learn how they ended
+            byId[args[0]['jobId']].status = args[0]['status']
+          self.worker.socketio.emit(event, *args, to=to)
+
+    def cacheStats(self) -> Optional[dict]:
+      return self.lastCacheStats
+
+    def shutdown(self):
+      try:
+        self.conn.send(('stop',))
+      except OSError:
+        pass
+      self.process.join()
 
 class Worker:
     def __init__(self, app: Flask, socketio: SocketIO):
       self.app = app
       self.socketio = socketio
-      self.queue = Queue()
+      self.queue = FairShareQueue(app.config.get('AFFINITY_MAX_OVERTAKES', 4))
       self.sessions: 'set[str]' = set()
+      self.owners: 'dict[str, str]' = {}
+      self.jobs: 'dict[str, BaseJob]' = {}
       self.stopping = False
-      self.thread = socketio.start_background_task(target=self, app=app)
+      self.estimator = RuntimeEstimator(app.config.get('DEFAULT_SECONDS_PER_COST', 10.0))
+      self.admission = AdmissionController(
+        app.config.get('MAX_JOB_COST', float('inf')),
+        app.config.get('USER_COST_BUDGET', float('inf')),
+        app.config.get('QUEUE_COST_CEILING', float('inf')),
+      )
+      self.journal: Optional[JobJournal] = None
+      # Unfinished jobs from the journal, replayed when their user reconnects
+      self.restored: 'dict[str, list[tuple[str, JobDefinition, float]]]' = {}
+      if app.config.get('JOB_JOURNAL'):
+        self.journal = JobJournal(
+          app.config['JOB_JOURNAL'],
+          maxAge=app.config.get('JOB_JOURNAL_MAX_AGE', float('inf')),
+        )
+        self.restored = self.journal.pending()
+      configs = LaneConfig.parse(app.config.get('WORKER_LANES'))
+      # The torch thread count is process-wide, so cpu lanes that want different
+      # counts can only get them in processes of their own.
+      cpuThreads = {config.threads for config in configs if config.device == 'cpu'}
+      laneClass = ProcessLane if app.config.get('WORKER_PROCESSES') or len(cpuThreads) > 1 else Lane
+      self.lanes = [laneClass(self, i, config) for (i, config) in enumerate(configs)]
+      # Lane processes have memory of their own that can't be prefetched into.
+      self.prefetcher: Optional[Prefetcher] = None
+      prefetchDepth = app.config.get('PREFETCH_DEPTH', len(self.lanes))
+      if prefetchDepth > 0 and laneClass is Lane:
+        self.prefetcher = Prefetcher(self, prefetchDepth)
+        self.prefetcher.start()
+      for lane in self.lanes:
+        lane.start(app)
+
+    def stats(self):
+      """Cache statistics of every process that runs jobs, thread lanes all share the server's."""
+      if isinstance(self.lanes[0], ProcessLane):
+        caches = [lane.cacheStats() for lane in self.lanes]
+      else:
+        caches = [self.lanes[0].cacheStats()]
+      return {
+        'queued': self.queue.qsize(),
+        'caches': caches,
+        'prefetch': self.prefetcher.stats() if self.prefetcher is not None else None,
+      }
 
     def updateQueue(self):
-      q: 'deque[Union[JobDefinition, Literal["stop"]]]' = self.queue.queue.copy()
-      for i, job in enumerate(q):
-        if (job == 'stop'):
-          break
-        sid = job['sid']
+      if self.prefetcher is not None:
+        self.prefetcher.notify()
+      now = time.time()
+      laneFreeAt = [max(lane.busyUntil, now) for lane in self.lanes]
+      for (sid, jobs) in self.queue.changedPositions(laneFreeAt).items():
         if (sid in self.sessions):
-          self.socketio.emit('job_progress', { 'jobId': job['jobId'], 'queuePos': i + 1 }, to=job['sid'])
+          self.socketio.emit(
+            'queue_update',
+            { 'jobs': [self.queueStatus(job) for job in jobs] },
+            to=sid,
+          )
 
-    def __call__(self, app: Flask):
-        with app.app_context():
-            while True:
-              job: Union[BaseJob, Literal['stop']] = self.queue.get()
-              if job == 'stop' or self.stopping:
-                self.queue.task_done()
-                break
-              if (job.sid not in self.sessions):
-                self.queue.task_done()
-                continue
-              self.updateQueue()
-              try:
-                job.run()
-              except Exception:
-                traceback.print_exc()
-              self.queue.task_done()
-
-    def enqueueJob(self, sid: str, jobDef: JobDefinition):
-      job = make_job(self.socketio, sid, jobDef)
-      qsize = self.queue.qsize()
+    @staticmethod
+    def queueStatus(job: BaseJob):
+      status = { 'jobId': job.id, 'queuePos': job.queuePos }
+      if job.eta is not None:
+        (status['startsAt'], status['finishesAt']) = job.eta
+      return status
+
+    def enqueueJob(self, sid: str, jobDef: JobDefinition, jobId: Optional[str] = None):
+      job = make_job(self.socketio, sid, jobDef, id=jobId)
+      job.owner = self.owners.get(sid, sid)
+      # Replayed jobs have no request to answer, they simply run again
+      cached = job.cachedResult([lane.device for lane in self.lanes]) if jobId is None else None
+      if cached is not None:
+        # Answered right away, the job never enters the queue
+        return { 'jobId': job.id, 'result': cached }
+      self.admission.admit(job)
+      job.estimate = self.estimator.estimate(job)
+      self.jobs[job.id] = job
+      # Only jobs of authenticated users can be matched to a session after a restart.
+      if self.journal is not None and sid in self.owners:
+        self.journal.enqueued(job)
       self.queue.put(job)
-      return (job.id, qsize + 1)
+      # Jobs of a new owner are interleaved ahead of other owners' backlog.
+      self.updateQueue()
+      return self.queueStatus(job)
+
+    def isRunnable(self, job: BaseJob) -> bool:
+      """Checks a dequeued job, telling its client when it is dropped because it was cancelled."""
+      if job.sid not in self.sessions:
+        return False
+      if job.cancelled:
+        job.complete('cancelled')
+        return False
+      return True
+
+    def finishJob(self, job: BaseJob):
+      self.jobs.pop(job.id, None)
+      self.admission.release(job)
+      if self.journal is not None:
+        self.journal.completed(job)
+      self.queue.task_done()
+
+    def cancelJob(self, sid: str, jobId: str) -> bool:
+      job = self.jobs.get(jobId)
+      if job is None or job.sid != sid:
+        return False
+      job.cancel()
+      # A queued job is dropped right away instead of when a lane reaches it,
+      # so it stops holding its owner's budget and other jobs' positions.
+      if self.queue.remove(job):
+        job.complete('cancelled')
+        self.finishJob(job)
+        self.updateQueue()
+      return True
 
-    def registerSid(self, sid: str):
+    def registerSid(self, sid: str, uid: Optional[str] = None):
       self.sessions.add(sid)
+      if uid is not None:
+        self.owners[sid] = uid
+        restored = []
+        for (jobId, jobDef, enqueuedAt) in self.restored.pop(uid, []):
+          if self.journal.expired(enqueuedAt):
+            self.journal.discard(jobId)
+            continue
+          try:
+            restored.append({ 'status': 'enqueued', **self.enqueueJob(sid, jobDef, jobId) })
+          except Exception as e:
+            traceback.print_exc()
+            # Otherwise it would be replayed, and fail, after every restart
+            self.journal.discard(jobId)
+            restored.append({ 'status': 'error', 'jobId': jobId, 'error': str(e) })
+        # The page only knows the ids of jobs it requested itself
+        if len(restored) > 0:
+          self.socketio.emit('jobs_restored', { 'jobs': restored }, to=sid)
 
     def deregisterSid(self, sid: str):
       self.sessions.discard(sid)
+      self.owners.pop(sid, None)
+      for job in list(self.jobs.values()):
+        if job.sid == sid:
+          job.cancel()
+          if self.queue.remove(job):
+            self.finishJob(job)
+      self.updateQueue()
 
     def stop(self):
       self.stopping = True
-      self.queue.put('stop')
-      self.thread.join()
\ No newline at end of file
+      if self.prefetcher is not None:
+        self.prefetcher.stop()
+      for _ in self.lanes:
+        self.queue.put('stop')
+      for lane in self.lanes:
+        lane.thread.join()
+      if self.journal is not None:
+        self.journal.close()